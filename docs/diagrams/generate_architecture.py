@@ -1,35 +1,32 @@
 """
 Generate an AWS architecture diagram using mingrammer/diagrams.
 Prereqs: Graphviz installed and on PATH; pip install diagrams.
+
+Rendered outputs are cached under .diagram_cache/ keyed on the emitted DOT
+source plus the `dot -V` banner, so unchanged diagrams skip Graphviz layout.
 """
 
+import argparse
+import functools
+import hashlib
+import os
+import re
+import shutil
+import subprocess
 import sys
 
-from diagrams import Cluster, Diagram, Edge
-from diagrams.aws.compute import EC2, Lambda
-from diagrams.aws.database import Dynamodb
-from diagrams.aws.integration import Eventbridge, SNS, StepFunctions
-from diagrams.aws.management import Cloudformation, Cloudwatch
-from diagrams.aws.security import IAM, KMS
-from diagrams.aws.storage import S3
-try:
-    from diagrams.generic.blank import Blank as TextNode  # type: ignore
-except Exception:  # fallback
-    TextNode = Lambda  # type: ignore
-
-# APIGateway import path can vary by diagrams version; add a fallback.
-try:  # diagrams >= 0.20
-    from diagrams.aws.network import APIGateway as APIIcon  # type: ignore
-except Exception:  # pragma: no cover - fallback to a generic icon
-    try:
-        from diagrams.aws.general import Client as APIIcon  # type: ignore
-    except Exception:  # last resort
-        APIIcon = Lambda  # type: ignore
+# `diagrams` (and transitively graphviz) is imported inside render() so that
+# importing this module, or running it when outputs are up to date, stays cheap.
 
 
 DIAGRAM_TITLE = "EC2 Patching Orchestrator (Hub-and-Spoke)"
 FILENAME = "architecture"
 
+# "full" is the diagram embedded in the README; "simplified" omits the approval flow.
+VARIANTS = ("full", "simplified")
+# Graphviz layout engines; "sfdp"/"neato" are force-directed and scale better than "dot".
+ENGINES = ("dot", "sfdp", "neato")
+
 # Layout and style
 GRAPH_ATTR = {
     "bgcolor": "white",
@@ -38,23 +35,126 @@ GRAPH_ATTR = {
     "nodesep": "0.6",
     "labelloc": "t",
     "fontsize": "20",
-    "concentrate": "true",
+    # Straight edges skip spline routing; concentrate's edge-merging pass is
+    # left off as it dominated layout time.
+    "splines": "line",
 }
 NODE_ATTR = {"shape": "box", "fontname": "Segoe UI", "fontsize": "12"}
 EDGE_ATTR = {"color": "gray40", "fontsize": "10"}
 
+# Invariant edge styles, resolved to Graphviz attributes once per render.
+EDGE_STYLES = {
+    "authn": {"color": "gray40", "label": "AuthN/AuthZ"},
+    "allow": {"color": "darkgreen", "label": "Allow", "penwidth": "2.0"},
+    "deny": {"color": "red", "style": "dashed", "label": "Deny"},
+    "assume_role": {"label": "AssumeRole", "style": "dashed", "color": "gray50", "constraint": "false"},
+    "run_patch": {"label": "RunPatchBaseline", "color": "steelblue"},
+    "get_results": {"label": "GetResults", "color": "steelblue"},
+}
+
+CACHE_DIR = os.environ.get(
+    "DIAGRAM_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".diagram_cache")
+)
+# diagrams assigns random uuid4 hex ids to nodes; normalize them so the DOT
+# source (and therefore the cache key) is stable across runs.
+_NODE_ID_RE = re.compile(r"\b[0-9a-f]{32}\b")
+
+
+def _dot_version() -> bytes:
+    try:
+        return subprocess.check_output(["dot", "-V"], stderr=subprocess.STDOUT)
+    except Exception:
+        return b""
+
+
+def _cache_key(dot_source: str) -> str:
+    ids = {}
+    stable = _NODE_ID_RE.sub(lambda m: ids.setdefault(m.group(0), f"n{len(ids)}"), dot_source)
+    return hashlib.sha256(stable.encode("utf-8") + _dot_version()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_diagram_class():
+    from diagrams import Diagram
+
+    class CachedDiagram(Diagram):
+        """Diagram that reuses a previously rendered image when the DOT source is unchanged."""
+
+        def render(self) -> None:
+            formats = self.outformat if isinstance(self.outformat, list) else [self.outformat]
+            key = _cache_key(self.dot.source)
+            cached = {fmt: os.path.join(CACHE_DIR, f"{key}.{fmt}") for fmt in formats}
+            if all(os.path.exists(path) for path in cached.values()):
+                # Diagram.__exit__ removes the DOT source file, so still write it.
+                self.dot.save()
+                for fmt, path in cached.items():
+                    shutil.copyfile(path, f"{self.filename}.{fmt}")
+                return
+            super().render()
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            for fmt, path in cached.items():
+                shutil.copyfile(f"{self.filename}.{fmt}", path)
+
+    return CachedDiagram
+
+
+@functools.lru_cache(maxsize=None)
+def _api_icon():
+    # APIGateway import path can vary by diagrams version; add a fallback.
+    try:  # diagrams >= 0.20
+        from diagrams.aws.network import APIGateway as APIIcon  # type: ignore
+    except Exception:  # pragma: no cover - fallback to a generic icon
+        try:
+            from diagrams.aws.general import Client as APIIcon  # type: ignore
+        except Exception:  # last resort
+            from diagrams.aws.compute import Lambda as APIIcon  # type: ignore
+    return APIIcon
+
+
+def _connect(diagram, pairs, attrs) -> None:
+    """Add (src, dst) node edges straight to the Graphviz graph.
+
+    Equivalent to `src >> Edge(...) >> dst` but skips diagrams' per-edge
+    operator dispatch and Edge construction.
+    """
+    add_edge = diagram.dot.edge
+    for src, dst in pairs:
+        add_edge(src.nodeid, dst.nodeid, **attrs)
 
-def render(outfmt: str = "png") -> None:
-    with Diagram(
+
+def _output_name(variant: str) -> str:
+    return FILENAME if variant == "full" else f"{FILENAME}-{variant}"
+
+
+def render(outfmt: str = "png", variant: str = "full", engine: str = "dot") -> None:
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown variant {variant!r}; expected one of {', '.join(VARIANTS)}")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}; expected one of {', '.join(ENGINES)}")
+    from diagrams import Cluster, Edge
+    from diagrams.aws.compute import EC2, Lambda
+    from diagrams.aws.database import Dynamodb
+    from diagrams.aws.integration import Eventbridge, SNS, StepFunctions
+    from diagrams.aws.management import Cloudformation, Cloudwatch
+    from diagrams.aws.security import IAM, KMS
+    from diagrams.aws.storage import S3
+
+    APIIcon = _api_icon()
+    plain = Edge(forward=True).attrs
+    styles = {name: Edge(forward=True, **attrs).attrs for name, attrs in EDGE_STYLES.items()}
+    # Drawn poll -> EC2 with the arrow pointing back at poll (`poll << edge << ec2`).
+    styles["get_results"]["dir"] = "back"
+    with_approval = variant == "full"
+    with _cached_diagram_class()(
         DIAGRAM_TITLE,
-        filename=FILENAME,
+        filename=_output_name(variant),
         show=False,
         outformat=outfmt,
         direction="LR",
-        graph_attr=GRAPH_ATTR,
+        graph_attr={**GRAPH_ATTR, "layout": engine},
         node_attr=NODE_ATTR,
         edge_attr=EDGE_ATTR,
-    ):
+    ) as diagram:
         # Hub
         with Cluster("Hub Account (Control Plane)"):
             with Cluster("Orchestration"):
@@ -67,11 +167,12 @@ def render(outfmt: str = "png") -> None:
                 poll = Lambda("PollSsmCommand")
                 post = Lambda("PostEC2Verify")
 
-            with Cluster("Approval Flow"):
-                api = APIIcon("Approvals API")
-                authorizer = Lambda("ApprovalAuthorizer")
-                approval = Lambda("ApprovalCallback")
-                rejected = Lambda("Rejected")
+            if with_approval:
+                with Cluster("Approval Flow"):
+                    api = APIIcon("Approvals API")
+                    authorizer = Lambda("ApprovalAuthorizer")
+                    approval = Lambda("ApprovalCallback")
+                    rejected = Lambda("Rejected")
 
             with Cluster("Data & Storage"):
                 ddb = Dynamodb("Execution State\n(TTL / PITR)")
@@ -87,34 +188,6 @@ def render(outfmt: str = "png") -> None:
             with Cluster("Deployment"):
                 cf = Cloudformation("CFN-Only Deployments")
 
-            # Hub flows
-            eb >> sfn
-            sfn >> inv
-            sfn >> send
-            sfn >> poll
-            sfn >> post
-            sfn >> sns
-
-            # API Gateway Authorizer: green allow, red reject
-            authorizer_allow = Edge(color="darkgreen", label="Allow", penwidth="2.0")
-            authorizer_deny = Edge(color="red", style="dashed", label="Deny")
-            api >> Edge(color="gray40", label="AuthN/AuthZ") >> authorizer
-            authorizer >> authorizer_allow >> approval
-            authorizer >> authorizer_deny >> rejected
-            approval >> sfn
-
-            for fn in [inv, send, poll, post, approval]:
-                fn >> ddb
-
-            for fn in [send, poll, post]:
-                fn >> s3
-
-            for svc in [ddb, s3, sns]:
-                svc >> kms
-
-            for src in [sfn, ddb, s3]:
-                src >> cw
-
         # Parameters & Limits section removed for a cleaner layout
 
         # Spokes (split by OS) - arrange horizontally
@@ -126,27 +199,70 @@ def render(outfmt: str = "png") -> None:
                     with Cluster("Region A..Z", graph_attr={"rank": "same"}):
                         ec2_win = EC2("Windows (Tagged)")
                         ec2_lin = EC2("Linux (Tagged)")
-                        # Invisible edge nudges Graphviz to keep them side-by-side
-                        ec2_win >> Edge(style="invis", weight="100", constraint="true") >> ec2_lin
+
+        # Hub flows
+        patching = [inv, send, poll, post]
+        state_writers = patching + [approval] if with_approval else patching
+        hub_edges = [(eb, sfn), (sfn, sns)] + [(sfn, fn) for fn in patching]
+        hub_edges += [(fn, ddb) for fn in state_writers]
+        hub_edges += [(fn, s3) for fn in (send, poll, post)]
+        hub_edges += [(svc, kms) for svc in (ddb, s3, sns)]
+        hub_edges += [(src, cw) for src in (sfn, ddb, s3)]
+        if with_approval:
+            hub_edges.append((approval, sfn))
+            # API Gateway Authorizer: green allow, red reject
+            _connect(diagram, [(api, authorizer)], styles["authn"])
+            _connect(diagram, [(authorizer, approval)], styles["allow"])
+            _connect(diagram, [(authorizer, rejected)], styles["deny"])
+        _connect(diagram, hub_edges, plain)
 
         # Cross-account assume role path
-        for fn in [inv, send, poll, post]:
-            fn >> Edge(label="AssumeRole", style="dashed", color="gray50", constraint="false") >> iam
+        _connect(diagram, [(fn, iam) for fn in patching], styles["assume_role"])
 
         # SSM Run Command path (conceptual)
-        send >> Edge(label="RunPatchBaseline", color="steelblue") >> ec2_win
-        send >> Edge(label="RunPatchBaseline", color="steelblue") >> ec2_lin
-        poll << Edge(label="GetResults", color="steelblue") << ec2_win
-        poll << Edge(label="GetResults", color="steelblue") << ec2_lin
+        _connect(diagram, [(send, ec2_win), (send, ec2_lin)], styles["run_patch"])
+        _connect(diagram, [(poll, ec2_win), (poll, ec2_lin)], styles["get_results"])
 
         # Legend removed for a cleaner, less cluttered SVG output
 
 
+def render_png_from_svg(variant: str = "full", engine: str = "dot") -> None:
+    """Rasterize the already laid-out SVG instead of running Graphviz a second time.
+
+    Falls back to a full `dot` PNG render when cairosvg is not installed.
+    """
+    try:
+        import cairosvg  # type: ignore
+    except ImportError:
+        render("png", variant, engine)
+        return
+    name = _output_name(variant)
+    cairosvg.svg2png(url=f"{name}.svg", write_to=f"{name}.png")
+
+
+def outputs_up_to_date(variant: str = "full") -> bool:
+    """True when both PNG and SVG exist and are newer than this script."""
+    name = _output_name(variant)
+    src_mtime = os.path.getmtime(__file__)
+    return all(
+        os.path.exists(path) and os.path.getmtime(path) >= src_mtime
+        for path in (f"{name}.png", f"{name}.svg")
+    )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("variant", nargs="?", default="full", choices=VARIANTS)
+    parser.add_argument("--engine", default="dot", choices=ENGINES, help="Graphviz layout engine (default: dot)")
+    parser.add_argument("--force", action="store_true", help="Render even if outputs are newer than this script")
+    args = parser.parse_args()
+    if not args.force and outputs_up_to_date(args.variant):
+        print("Diagram outputs are up to date; use --force to re-render.")
+        sys.exit(0)
     try:
-        # Render both PNG and SVG for crisp docs embeds
-        render("png")
-        render("svg")
+        # Lay out once as SVG for crisp docs embeds, then rasterize the PNG from it
+        render("svg", args.variant, args.engine)
+        render_png_from_svg(args.variant, args.engine)
     except Exception as e:
         # Common failure is Graphviz 'dot' not found or diagrams import mismatch
         print(f"Failed to render diagram: {e}")
@@ -10,7 +10,16 @@ from botocore.exceptions import ClientError
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+_sm = boto3.client("secretsmanager")
+
+# Cheap shape checks applied before any crypto or secret access. Signatures are
+# lowercase hex SHA-256 digests; task tokens from Step Functions stay under 2048.
+_SIG_LEN = 64
+_HEX_CHARS = frozenset("0123456789abcdef")
+_MAX_TOKEN_LEN = 2048
+_MAX_FIELD_LEN = 256
 _cached_secret_value = None
+_hmac_template = None
 
 def _get_signing_secret() -> bytes:
     global _cached_secret_value
@@ -19,24 +28,40 @@ def _get_signing_secret() -> bytes:
     secret_arn = os.environ.get("APPROVAL_SIGNING_SECRET_ARN")
     if not secret_arn:
         raise RuntimeError("APPROVAL_SIGNING_SECRET_ARN not set")
-    sm = boto3.client("secretsmanager")
-    resp = sm.get_secret_value(SecretId=secret_arn)
+    resp = _sm.get_secret_value(SecretId=secret_arn)
     val = resp.get("SecretString")
     if not val and "SecretBinary" in resp:
         val = resp["SecretBinary"].decode("utf-8")
-    try:
-        parsed = json.loads(val)
-        val = parsed.get("secret") or parsed.get("value") or val
-    except Exception:
-        pass
+    # Only JSON-wrapped secrets ({"secret": ...} / {"value": ...}) need parsing.
+    if val.lstrip().startswith("{"):
+        try:
+            parsed = json.loads(val)
+            val = parsed.get("secret") or parsed.get("value") or val
+        except ValueError:
+            pass
     _cached_secret_value = val.encode("utf-8")
     return _cached_secret_value
 
-def _const_eq(a: str, b: str) -> bool:
+def _get_hmac_template() -> "hmac.HMAC":
+    # Keyed HMAC with the inner/outer pads already absorbed; callers .copy() it.
+    global _hmac_template
+    if _hmac_template is None:
+        _hmac_template = hmac.new(_get_signing_secret(), digestmod=hashlib.sha256)
+    return _hmac_template
+
+# Fetch the secret during Lambda init so warm invocations only do HMAC work.
+# Failures are retried lazily from the handler.
+if os.environ.get("APPROVAL_SIGNING_SECRET_ARN"):
+    try:
+        _get_hmac_template()
+    except Exception as e:
+        logger.warning(f"Deferred signing secret fetch: {e}")
+
+def _const_eq(a: bytes, b: bytes) -> bool:
     return hmac.compare_digest(a, b)
 
-def _build_canonical_string(token: str, timestamp: str, action: str, execution_id: str) -> str:
-    return f"{token}:{timestamp}:{action}:{execution_id}"
+def _build_canonical_string(token: bytes, timestamp: bytes, action: bytes, execution_id: bytes) -> bytes:
+    return b":".join((token, timestamp, action, execution_id))
 
 def handler(event, context):
     try:
@@ -48,17 +73,28 @@ def handler(event, context):
         execution_id = (query.get("executionId") or "").strip()
         if not all([sig, token, ts, action]):
             return {"isAuthorized": False}
+        if len(sig) != _SIG_LEN or not _HEX_CHARS.issuperset(sig):
+            return {"isAuthorized": False}
+        # Fields are encoded once here; the limits then bound the bytes fed to HMAC.
+        # The signer encodes UTF-8, so non-ASCII values still verify.
+        token_b = token.encode("utf-8")
+        action_b = action.encode("utf-8")
+        execution_id_b = execution_id.encode("utf-8")
+        if len(token_b) > _MAX_TOKEN_LEN or len(action_b) > _MAX_FIELD_LEN or len(execution_id_b) > _MAX_FIELD_LEN:
+            return {"isAuthorized": False}
         max_age_minutes = int(os.environ.get("APPROVAL_EXPIRY_MINUTES", "60"))
-        try:
-            ts_int = int(ts)
-        except ValueError:
+        # Epoch seconds: ASCII digits only, at most 10 of them.
+        if len(ts) > 10 or not (ts.isascii() and ts.isdigit()):
             return {"isAuthorized": False}
+        ts_int = int(ts)
         if abs(int(time.time()) - ts_int) > max_age_minutes * 60:
             return {"isAuthorized": False}
-        secret = _get_signing_secret()
-        canonical = _build_canonical_string(token, ts, action, execution_id)
-        expected = hmac.new(secret, canonical.encode("utf-8"), hashlib.sha256).hexdigest()
-        if not _const_eq(expected, sig):
+        # ts passed the ASCII-digit check above, so its ASCII encoding is exact
+        canonical = _build_canonical_string(token_b, ts.encode("ascii"), action_b, execution_id_b)
+        mac = _get_hmac_template().copy()
+        mac.update(canonical)
+        expected = mac.digest()
+        if not _const_eq(expected, bytes.fromhex(sig)):
             return {"isAuthorized": False}
         return {"isAuthorized": True, "context": {"action": action, "executionId": execution_id or "unknown"}}
     except Exception as e:
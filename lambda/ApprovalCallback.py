@@ -1,15 +1,34 @@
 import os
 import json
-import boto3
+import botocore.session
 import uuid
 import time
+import random
 import logging
+import logging.handlers
+import queue
+import threading
+import re
+import gzip
+import base64
 import urllib.parse
 import hashlib
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from typing import Dict, Any
 from botocore.exceptions import ClientError, BotoCoreError
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+# orjson is optional; it is not part of the Lambda artifact unless vendored into it
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=str).decode('utf-8')
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, default=str)
 
 # Configure structured logging
 logging.basicConfig(
@@ -18,6 +37,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamp each log record with the current invocation's correlation ID"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _correlation_id.get()
+        return True
+
+# Route records through a queue so stream writes happen on a background listener
+# thread. The correlation ID is stamped on the request thread, before enqueueing.
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.addFilter(CorrelationIdFilter())
+_root_logger = logging.getLogger()
+_log_listener = logging.handlers.QueueListener(_log_queue, *_root_logger.handlers, respect_handler_level=True)
+_root_logger.handlers = [_queue_handler]
+_log_listener.start()
+
+# Global clients, reused across warm invocations. Low-level clients come straight
+# from botocore so the boto3 wrapper is only imported for the DynamoDB resource.
+_botocore_session = botocore.session.get_session()
+sfn_client = _botocore_session.create_client('stepfunctions')
+sns_client = _botocore_session.create_client('sns')
+NOTIFICATION_TOPIC_ARN = os.environ.get('NOTIFICATION_TOPIC_ARN')
+_NOTIFICATION_TYPE_ATTR = {'DataType': 'String', 'StringValue': 'ApprovalDecision'}
+# When set, audit records are queued for AuditBatchWriter instead of written directly
+AUDIT_QUEUE_URL = os.environ.get('AUDIT_QUEUE_URL')
+sqs_client = _botocore_session.create_client('sqs') if AUDIT_QUEUE_URL else None
+AUDIT_TABLE = os.environ.get('AUDIT_TABLE')
+if AUDIT_TABLE and not AUDIT_QUEUE_URL:
+    import boto3
+    audit_table = boto3.resource('dynamodb').Table(AUDIT_TABLE)
+else:
+    audit_table = None
+
+_VALID_ACTIONS = frozenset({'approve', 'reject'})
+APPROVAL_EXPIRY_SECONDS = int(os.environ.get('APPROVAL_EXPIRY_MINUTES', '60')) * 60
+_TTL_SECONDS = 365 * 24 * 3600  # audit records expire after a year
+
+# Runs the audit write alongside the Step Functions call; joined before the handler returns
+_side_effects = ThreadPoolExecutor(max_workers=2)
+
 class ApprovalCallbackError(Exception):
     """Custom exception for approval callback operations"""
     pass
@@ -26,36 +87,62 @@ def with_correlation_id(func):
     """Decorator to add correlation ID to all log messages"""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        correlation_id = str(uuid.uuid4())[:8]
-        old_factory = logging.getLogRecordFactory()
-        def record_factory(*args, **kwargs):
-            record = old_factory(*args, **kwargs)
-            record.correlation_id = correlation_id
-            return record
-        logging.setLogRecordFactory(record_factory)
+        token = _correlation_id.set(uuid.uuid4().hex[:8])
         try:
             return func(*args, **kwargs)
         finally:
-            logging.setLogRecordFactory(old_factory)
+            _correlation_id.reset(token)
+            # Drain queued log records before Lambda freezes the environment
+            _log_queue.join()
     return wrapper
 
-def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0):
+_NON_RETRYABLE = frozenset({'ValidationException', 'InvalidParameterValue', 'TaskDoesNotExist', 'AccessDeniedException'})
+_THROTTLING_CODES = frozenset({'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded'})
+
+# Per-container send budget shared by every retried call, in the spirit of botocore's
+# "adaptive" retry mode: each attempt spends a token and throttling spends one more,
+# so a burst of throttled approvals slows down instead of amplifying the storm.
+_BUCKET_CAPACITY = 10.0
+_BUCKET_REFILL_PER_SEC = 5.0
+_bucket = {'tokens': _BUCKET_CAPACITY, 'last': time.monotonic()}
+_bucket_lock = threading.Lock()
+
+def _take_tokens(cost: float = 1.0, block: bool = True) -> None:
+    """Spend `cost` tokens, sleeping until the bucket refills if it is overdrawn"""
+    with _bucket_lock:
+        now = time.monotonic()
+        tokens = min(_BUCKET_CAPACITY, _bucket['tokens'] + (now - _bucket['last']) * _BUCKET_REFILL_PER_SEC)
+        _bucket['last'] = now
+        _bucket['tokens'] = tokens - cost
+    if block and tokens < cost:
+        time.sleep((cost - tokens) / _BUCKET_REFILL_PER_SEC)
+
+def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0, cap: float = 20.0):
+    """Retry AWS calls with full-jitter exponential backoff, capped at `cap` seconds"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
+                _take_tokens()
                 try:
                     return func(*args, **kwargs)
                 except (ClientError, BotoCoreError) as e:
                     error_code = e.response.get('Error', {}).get('Code', 'Unknown') if hasattr(e, 'response') else 'Unknown'
+                    status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) if hasattr(e, 'response') else 0
+                    if status_code == 429 or error_code in _THROTTLING_CODES:
+                        _take_tokens(block=False)
                     if attempt == max_retries - 1:
                         logger.error(f"Final retry failed for {func.__name__}: {error_code} - {str(e)}")
                         raise
-                    if error_code in ['ValidationException', 'InvalidParameterValue', 'TaskDoesNotExist']:
+                    if error_code in _NON_RETRYABLE:
                         logger.error(f"Non-retryable error: {error_code}")
                         raise
-                    delay = base_delay * (2 ** attempt)
-                    logger.warning(f"Retry {attempt + 1}/{max_retries} for {func.__name__} after {delay}s: {error_code}")
+                    # Other 4xx client errors will not succeed on retry; throttling and 5xx may
+                    if 400 <= status_code < 500 and status_code != 429 and error_code not in _THROTTLING_CODES:
+                        logger.error(f"Non-retryable client error: {error_code} (HTTP {status_code})")
+                        raise
+                    delay = random.uniform(0, min(cap, base_delay * (2 ** attempt)))
+                    logger.warning(f"Retry {attempt + 1}/{max_retries} for {func.__name__} after {delay:.2f}s: {error_code}")
                     time.sleep(delay)
             return None
         return wrapper
@@ -66,7 +153,7 @@ def validate_request(event: Dict[str, Any]) -> Dict[str, Any]:
     if not query_params:
         raise ApprovalCallbackError("Missing query string parameters")
     action = query_params.get('action')
-    if not action or action not in ('approve', 'reject'):
+    if action not in _VALID_ACTIONS:
         raise ApprovalCallbackError(f"Invalid or missing action parameter. Expected 'approve' or 'reject', got: {action}")
     token = query_params.get('token')
     if not token:
@@ -79,13 +166,13 @@ def validate_request(event: Dict[str, Any]) -> Dict[str, Any]:
     timestamp = query_params.get('timestamp')
     if timestamp:
         try:
-            timestamp_int = int(timestamp)
-            request_time = datetime.fromtimestamp(timestamp_int)
-            expiry_minutes = int(os.environ.get('APPROVAL_EXPIRY_MINUTES', '60'))
-            if datetime.now() - request_time > timedelta(minutes=expiry_minutes):
-                raise ApprovalCallbackError(f"Approval request expired. Request was made {datetime.now() - request_time} ago")
+            request_ts = int(timestamp)
         except ValueError:
             logger.warning(f"Invalid timestamp format: {timestamp}")
+        else:
+            age_seconds = int(time.time()) - request_ts
+            if age_seconds > APPROVAL_EXPIRY_SECONDS:
+                raise ApprovalCallbackError(f"Approval request expired. Request was made {timedelta(seconds=age_seconds)} ago")
     source_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'unknown')
     user_agent = event.get('headers', {}).get('User-Agent', 'unknown')
     return {
@@ -97,88 +184,69 @@ def validate_request(event: Dict[str, Any]) -> Dict[str, Any]:
         'user_agent': user_agent
     }
 
-def log_approval_decision(action: str, execution_id: str, source_ip: str, user_agent: str, task_token_hash: str) -> None:
-    audit_data = {
+def log_approval_decision(action: str, execution_id: str, source_ip: str, user_agent: str, task_token_hash: str, now: datetime) -> None:
+    # One dict serves as both the log line and the stored item. 'timestamp' stays the
+    # ISO string, which is what the spread of the old log dict left in stored items.
+    audit_record = {
+        'audit_id': uuid.uuid4().hex,
         'event_type': 'approval_decision',
         'action': action,
         'execution_id': execution_id,
         'task_token_hash': task_token_hash,
         'source_ip': source_ip,
         'user_agent': user_agent,
-        'timestamp': datetime.utcnow().isoformat(),
+        'timestamp': now.isoformat(timespec='seconds'),
+        'ttl': int(now.timestamp()) + _TTL_SECONDS,
         'requestor': 'manual_approval_system'
     }
-    logger.info(f"Approval decision recorded: {json.dumps(audit_data)}")
-    audit_table = os.environ.get('AUDIT_TABLE')
-    if audit_table:
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Approval decision recorded: %s", _dumps(audit_record))
+    if AUDIT_QUEUE_URL or audit_table is not None:
         try:
-            dynamodb = boto3.resource('dynamodb')
-            table = dynamodb.Table(audit_table)
-            table.put_item(
-                Item={
-                    'audit_id': str(uuid.uuid4()),
-                    'timestamp': int(time.time()),
-                    'ttl': int(time.time()) + (365 * 24 * 3600),
-                    **audit_data
-                }
-            )
-            logger.info(f"Audit record stored: {audit_data['action']} for execution {execution_id}")
+            if AUDIT_QUEUE_URL:
+                sqs_client.send_message(QueueUrl=AUDIT_QUEUE_URL, MessageBody=_dumps(audit_record))
+                logger.info(f"Audit record queued: {action} for execution {execution_id}")
+            else:
+                audit_table.put_item(Item=audit_record)
+                logger.info(f"Audit record stored: {action} for execution {execution_id}")
         except Exception as e:
             logger.warning(f"Failed to store audit record: {str(e)}")
 
 @retry_with_backoff(max_retries=3, base_delay=1.0)
-def send_task_success(task_token: str, execution_id: str) -> Dict[str, Any]:
-    sf_client = boto3.client('stepfunctions')
-    output_data = {
-        'approved': True,
-        'approval_timestamp': datetime.utcnow().isoformat(),
-        'execution_id': execution_id,
-        'decision': 'approved'
-    }
-    logger.info(f"Sending task success for execution {execution_id}")
-    response = sf_client.send_task_success(taskToken=task_token, output=json.dumps(output_data))
-    logger.info(f"Task success sent successfully for execution {execution_id}")
-    return {'success': True, 'response': response, 'output_data': output_data}
-
-@retry_with_backoff(max_retries=3, base_delay=1.0)
-def send_task_failure(task_token: str, execution_id: str, reason: str = "Manual rejection") -> Dict[str, Any]:
-    sf_client = boto3.client('stepfunctions')
-    error_details = {
-        'rejected': True,
-        'rejection_timestamp': datetime.utcnow().isoformat(),
-        'execution_id': execution_id,
-        'decision': 'rejected',
-        'reason': reason
-    }
+def _send_decision(approved: bool, task_token: str, execution_id: str, now_iso: str, reason: str = "Manual rejection") -> Dict[str, Any]:
+    """Report the operator's decision to Step Functions as task success (approve) or failure (reject)"""
+    if approved:
+        payload = {'approved': True, 'approval_timestamp': now_iso, 'execution_id': execution_id, 'decision': 'approved'}
+        logger.info(f"Sending task success for execution {execution_id}")
+        response = sfn_client.send_task_success(taskToken=task_token, output=_dumps(payload))
+        logger.info(f"Task success sent successfully for execution {execution_id}")
+        return {'success': True, 'response': response, 'output_data': payload}
+    payload = {'rejected': True, 'rejection_timestamp': now_iso, 'execution_id': execution_id, 'decision': 'rejected', 'reason': reason}
     logger.info(f"Sending task failure for execution {execution_id}")
-    response = sf_client.send_task_failure(taskToken=task_token, error='ManualRejection', cause=json.dumps(error_details))
+    response = sfn_client.send_task_failure(taskToken=task_token, error='ManualRejection', cause=_dumps(payload))
     logger.info(f"Task failure sent successfully for execution {execution_id}")
-    return {'success': True, 'response': response, 'error_details': error_details}
+    return {'success': True, 'response': response, 'error_details': payload}
 
-def send_notification(action: str, execution_id: str, success: bool) -> bool:
-    topic_arn = os.environ.get('NOTIFICATION_TOPIC_ARN')
-    if not topic_arn:
+def send_notification(action: str, execution_id: str, success: bool, now_human: str) -> bool:
+    if not NOTIFICATION_TOPIC_ARN:
         return False
     try:
-        sns_client = boto3.client('sns')
         status = "Approved" if action == 'approve' else "Rejected"
-        result_status = "successfully" if success else "with errors"
-        subject = f"EC2 Patching {status} - {execution_id}"
-        message = f"""
-Approval Decision Processed {result_status}
-
-Execution ID: {execution_id}
-Action: {action.upper()}
-Status: {status}
-Timestamp: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}
-Result: {'Success' if success else 'Error occurred'}
-"""
+        message = "\n".join((
+            f"Approval Decision Processed {'successfully' if success else 'with errors'}",
+            "",
+            f"Execution ID: {execution_id}",
+            f"Action: {action.upper()}",
+            f"Status: {status}",
+            f"Timestamp: {now_human}",
+            f"Result: {'Success' if success else 'Error occurred'}"
+        ))
         sns_client.publish(
-            TopicArn=topic_arn,
-            Subject=subject,
-            Message=message.strip(),
+            TopicArn=NOTIFICATION_TOPIC_ARN,
+            Subject=f"EC2 Patching {status} - {execution_id}",
+            Message=message,
             MessageAttributes={
-                'NotificationType': {'DataType': 'String', 'StringValue': 'ApprovalDecision'},
+                'NotificationType': _NOTIFICATION_TYPE_ATTR,
                 'Action': {'DataType': 'String', 'StringValue': action},
                 'ExecutionId': {'DataType': 'String', 'StringValue': execution_id}
             }
@@ -188,14 +256,7 @@ Result: {'Success' if success else 'Error occurred'}
         logger.warning(f"Failed to send notification: {str(e)}")
         return False
 
-def generate_response_html(action: str, success: bool, error_message: str = None) -> str:
-    status_icon, status_text, message, color = ('⚠️', 'Error Processing Request', f"An error occurred while processing your {action} request: {error_message}", '#ffc107')
-    if success:
-        if action == 'approve':
-            status_icon, status_text, message, color = ('✅', 'Approved Successfully', 'The EC2 patching operation has been approved and will now continue.', '#28a745')
-        else:
-            status_icon, status_text, message, color = ('❌', 'Rejected Successfully', 'The EC2 patching operation has been rejected and will not proceed.', '#dc3545')
-    html = f"""
+_HTML_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -215,16 +276,49 @@ def generate_response_html(action: str, success: bool, error_message: str = None
             <div class="status-icon">{status_icon}</div>
             <div class="status-text">{status_text}</div>
             <div class="message">{message}</div>
-            <div class="timestamp">Processed at: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}</div>
+            <div class="timestamp">Processed at: {timestamp}</div>
         </div>
     </body>
     </html>
     """
-    return html.strip()
+# Drop the source indentation and newlines; every line break falls between tags or CSS rules
+_HTML_TEMPLATE = re.sub(r'\s*\n\s*', '', _HTML_TEMPLATE)
+
+# (status_icon, status_text, message, color) for successfully processed decisions
+_SUCCESS_STATUS = {
+    'approve': ('✅', 'Approved Successfully', 'The EC2 patching operation has been approved and will now continue.', '#28a745'),
+    'reject': ('❌', 'Rejected Successfully', 'The EC2 patching operation has been rejected and will not proceed.', '#dc3545'),
+}
+
+def generate_response_html(action: str, success: bool, timestamp: str, error_message: str = None) -> str:
+    if success:
+        status_icon, status_text, message, color = _SUCCESS_STATUS['approve' if action == 'approve' else 'reject']
+    else:
+        status_icon, status_text, message, color = ('⚠️', 'Error Processing Request', f"An error occurred while processing your {action} request: {error_message}", '#ffc107')
+    return _HTML_TEMPLATE.format_map({
+        'status_icon': status_icon,
+        'status_text': status_text,
+        'message': message,
+        'color': color,
+        'timestamp': timestamp
+    })
+
+# Success pages are rendered once at import; only the processed-at time is filled in per request
+_TIMESTAMP_SLOT = '\x00timestamp\x00'
+_SUCCESS_PAGES = {action: generate_response_html(action, True, _TIMESTAMP_SLOT) for action in _SUCCESS_STATUS}
+
+def _accepts_gzip(event: Dict[str, Any]) -> bool:
+    # HTTP API payload v2.0 lower-cases header names
+    headers = event.get('headers') or {}
+    return 'gzip' in (headers.get('accept-encoding') or headers.get('Accept-Encoding') or '')
 
 @with_correlation_id
 def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
     start_time = time.time()
+    # One clock read per request, shared by the audit record, Step Functions payload, SNS and HTML
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat(timespec='seconds')
+    now_human = now.strftime('%Y-%m-%d %H:%M:%S UTC')
     try:
         logger.info(f"Processing approval callback with event keys: {list(event.keys())}")
         request_data = validate_request(event)
@@ -233,23 +327,32 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         execution_id = request_data['execution_id']
         source_ip = request_data['source_ip']
         user_agent = request_data['user_agent']
-        task_token_hash = hashlib.md5(task_token.encode()).hexdigest()[:8]
+        # 8-hex-char, non-cryptographic fingerprint correlating the request with its audit trail
+        task_token_hash = hashlib.blake2b(task_token.encode(), digest_size=4).hexdigest()
         logger.info(f"Processing {action} request for execution {execution_id} from IP {source_ip}")
-        log_approval_decision(action, execution_id, source_ip, user_agent, task_token_hash)
-        if action == 'approve':
-            result = send_task_success(task_token, execution_id)
-        else:
-            result = send_task_failure(task_token, execution_id, "Operator manually rejected the operation")
+        # copy_context() carries the correlation ID into the worker thread
+        audit_future = _side_effects.submit(copy_context().run, log_approval_decision, action, execution_id, source_ip, user_agent, task_token_hash, now)
+        try:
+            result = _send_decision(action == 'approve', task_token, execution_id, now_iso, "Operator manually rejected the operation")
+        finally:
+            audit_future.result()
         success = result.get('success', False)
-        send_notification(action, execution_id, success)
+        send_notification(action, execution_id, success, now_human)
         if success:
-            html_response = generate_response_html(action, True)
-            return {'statusCode': 200, 'headers': {'Content-Type': 'text/html', 'Cache-Control': 'no-cache'}, 'body': html_response}
+            page = _SUCCESS_PAGES[action].replace(_TIMESTAMP_SLOT, now_human)
+            if _accepts_gzip(event):
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'text/html', 'Cache-Control': 'no-cache', 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'},
+                    'body': base64.b64encode(gzip.compress(page.encode('utf-8'))).decode('ascii'),
+                    'isBase64Encoded': True
+                }
+            return {'statusCode': 200, 'headers': {'Content-Type': 'text/html', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}, 'body': page}
         else:
             return {'statusCode': 500, 'headers': {'Content-Type': 'text/plain'}, 'body': f"Error processing {action} request"}
     except ApprovalCallbackError as e:
-        html_response = generate_response_html('unknown', False, str(e))
+        html_response = generate_response_html('unknown', False, now_human, str(e))
         return {'statusCode': 400, 'headers': {'Content-Type': 'text/html', 'Cache-Control': 'no-cache'}, 'body': html_response}
     except Exception as e:
-        html_response = generate_response_html('unknown', False, "An unexpected error occurred")
+        html_response = generate_response_html('unknown', False, now_human, "An unexpected error occurred")
         return {'statusCode': 500, 'headers': {'Content-Type': 'text/html', 'Cache-Control': 'no-cache'}, 'body': html_response}
@@ -0,0 +1,88 @@
+"""
+Approval Audit Batch Writer Lambda Function
+Drains approval audit records queued by ApprovalCallback (SQS) into DynamoDB using
+BatchWriteItem, 25 items per request, and reports per-message failures back to SQS.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+from typing import Dict, Any, List, Set, Tuple
+import boto3
+from botocore.exceptions import ClientError, BotoCoreError
+
+# Configure structured logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Global resource, reused across warm invocations
+dynamodb = boto3.resource('dynamodb')
+
+BATCH_SIZE = 25  # BatchWriteItem limit
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.1
+MAX_DELAY = 5.0
+# Retrying these cannot succeed; the batch goes straight back to SQS (and on to the DLQ)
+NON_RETRYABLE_ERRORS = ('ResourceNotFoundException', 'ValidationException', 'AccessDeniedException')
+
+def write_batch(table_name: str, items: List[Dict[str, Any]]) -> Set[str]:
+    """Write up to 25 items, retrying UnprocessedItems with full-jitter backoff.
+
+    Returns the audit_ids that could not be written.
+    """
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt))))
+        try:
+            response = dynamodb.batch_write_item(RequestItems={table_name: requests})
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+            logger.warning(f"BatchWriteItem attempt {attempt + 1}/{MAX_ATTEMPTS} failed: {error_code} - {str(e)}")
+            if error_code in NON_RETRYABLE_ERRORS:
+                break
+            continue
+        except BotoCoreError as e:
+            logger.warning(f"BatchWriteItem attempt {attempt + 1}/{MAX_ATTEMPTS} failed: {str(e)}")
+            continue
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not requests:
+            return set()
+        logger.warning(f"{len(requests)} audit records unprocessed after attempt {attempt + 1}/{MAX_ATTEMPTS}")
+    return {request['PutRequest']['Item']['audit_id'] for request in requests}
+
+def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
+    """
+    SQS batch handler. Expects the event source mapping to enable
+    ReportBatchItemFailures so only failed messages are redelivered.
+    """
+    table_name = os.environ['AUDIT_TABLE']
+    records = event.get('Records', [])
+    failed_message_ids: List[str] = []
+    # audit_id -> (item, messageIds). SQS may redeliver a message within one batch, and
+    # BatchWriteItem rejects a request that puts the same key twice.
+    pending: Dict[str, Tuple[Dict[str, Any], List[str]]] = {}
+
+    for record in records:
+        try:
+            item = json.loads(record['body'])
+            pending.setdefault(item['audit_id'], (item, []))[1].append(record['messageId'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Malformed audit message {record.get('messageId')}: {str(e)}")
+            failed_message_ids.append(record.get('messageId'))
+
+    entries = list(pending.items())
+    for start in range(0, len(entries), BATCH_SIZE):
+        chunk = entries[start:start + BATCH_SIZE]
+        unwritten = write_batch(table_name, [item for _, (item, _) in chunk])
+        for audit_id, (_, message_ids) in chunk:
+            if audit_id in unwritten:
+                failed_message_ids.extend(message_ids)
+
+    logger.info(f"Wrote {len(records) - len(failed_message_ids)}/{len(records)} audit records to {table_name}")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
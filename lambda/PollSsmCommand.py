@@ -3,11 +3,14 @@ import json
 import boto3
 import uuid
 import time
+import random
 import logging
 from typing import Dict, Any, List, Optional
+from botocore.config import Config
 from botocore.exceptions import ClientError, BotoCoreError
 from functools import wraps
 from datetime import datetime, timedelta
+from contextvars import ContextVar
 
 # Configure structured logging
 logging.basicConfig(
@@ -16,7 +19,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamp each log record with the current invocation's correlation ID"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _correlation_id.get()
+        return True
+
+for _log_handler in logging.getLogger().handlers:
+    _log_handler.addFilter(CorrelationIdFilter())
+
 s3_client = boto3.client('s3')
+# Reused across warm invocations. assume_cross_account_role maps ClientError to
+# SSMPollingError before retry_with_backoff sees it, so botocore owns STS retries.
+sts_client = boto3.client('sts', config=Config(
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=10,
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+))
+
+# S3 metadata objects are machine-consumed: compact JSON unless PRETTY_JSON=1 is set for debugging
+_JSON_FORMAT = {'indent': 2} if os.environ.get('PRETTY_JSON') == '1' else {'separators': (',', ':')}
 
 class SSMPollingError(Exception):
     """Custom exception for SSM polling operations"""
@@ -26,25 +51,23 @@ def with_correlation_id(func):
     """Decorator to add correlation ID to all log messages"""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        correlation_id = str(uuid.uuid4())[:8]
-        
-        old_factory = logging.getLogRecordFactory()
-        def record_factory(*args, **kwargs):
-            record = old_factory(*args, **kwargs)
-            record.correlation_id = correlation_id
-            return record
-        
-        logging.setLogRecordFactory(record_factory)
-        
+        token = _correlation_id.set(uuid.uuid4().hex[:8])
         try:
             return func(*args, **kwargs)
         finally:
-            logging.setLogRecordFactory(old_factory)
-    
+            _correlation_id.reset(token)
     return wrapper
 
-def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0):
-    """Decorator for retry logic with exponential backoff"""
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-provided Retry-After delay in seconds, if the error response carries one"""
+    headers = getattr(error, 'response', {}).get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    try:
+        return max(0.0, float(headers['retry-after']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0, cap: float = 30.0):
+    """Decorator for retry logic with full-jitter exponential backoff, capped at `cap` seconds"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -55,15 +78,17 @@ def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0):
                     error_code = e.response.get('Error', {}).get('Code', 'Unknown') if hasattr(e, 'response') else 'Unknown'
                     
                     if attempt == max_retries - 1:
-                        logger.error(f"Final retry failed for {func.__name__}: {error_code} - {str(e)}")
+                        logger.error("Final retry failed for %s: %s - %s", func.__name__, error_code, e)
                         raise
                     
                     if error_code in ['ValidationException', 'AccessDeniedException']:
-                        logger.error(f"Non-retryable error: {error_code}")
+                        logger.error("Non-retryable error: %s", error_code)
                         raise
                     
-                    delay = base_delay * (2 ** attempt)
-                    logger.warning(f"Retry {attempt + 1}/{max_retries} for {func.__name__} after {delay}s: {error_code}")
+                    # An explicit Retry-After wins; otherwise jitter so throttled pollers spread out
+                    delay = _retry_after_seconds(e)
+                    delay = min(cap, delay) if delay is not None else random.uniform(0, min(cap, base_delay * (2 ** attempt)))
+                    logger.warning("Retry %d/%d for %s after %.2fs: %s", attempt + 1, max_retries, func.__name__, delay, error_code)
                     time.sleep(delay)
             return None
         return wrapper
@@ -115,10 +140,9 @@ def validate_input(event: Dict[str, Any]) -> Dict[str, Any]:
 def assume_cross_account_role(role_arn: str, account_id: str, external_id: str = "") -> Dict[str, str]:
     """Assume cross-account role with enhanced error handling"""
     try:
-        sts_client = boto3.client('sts')
         session_name = f"ssm-polling-{account_id}-{int(time.time())}"
         
-        logger.info(f"Assuming role: {role_arn}")
+        logger.info("Assuming role: %s", role_arn)
         
         params = {
             'RoleArn': role_arn,
@@ -130,7 +154,7 @@ def assume_cross_account_role(role_arn: str, account_id: str, external_id: str =
         response = sts_client.assume_role(**params)
         
         credentials = response['Credentials']
-        logger.info(f"Successfully assumed role for account {account_id}")
+        logger.info("Successfully assumed role for account %s", account_id)
         
         return credentials
         
@@ -138,7 +162,7 @@ def assume_cross_account_role(role_arn: str, account_id: str, external_id: str =
         error_code = e.response.get('Error', {}).get('Code', 'Unknown')
         error_message = e.response.get('Error', {}).get('Message', str(e))
         
-        logger.error(f"Failed to assume role {role_arn}: {error_code} - {error_message}")
+        logger.error("Failed to assume role %s: %s - %s", role_arn, error_code, error_message)
         
         if error_code == 'AccessDenied':
             raise SSMPollingError(f"Access denied assuming role in account {account_id}. Check cross-account trust relationship.")
@@ -158,14 +182,14 @@ def create_ssm_client(credentials: Dict[str, str], region: str) -> boto3.client:
             aws_session_token=credentials['SessionToken']
         )
     except Exception as e:
-        logger.error(f"Failed to create SSM client: {str(e)}")
+        logger.error("Failed to create SSM client: %s", e)
         raise SSMPollingError(f"SSM client creation failed: {str(e)}")
 
 @retry_with_backoff(max_retries=3)
 def get_command_invocations(ssm_client, command_id: str) -> List[Dict[str, Any]]:
     """Get command invocations with pagination and detailed status"""
     try:
-        logger.info(f"Retrieving command invocations for: {command_id}")
+        logger.info("Retrieving command invocations for: %s", command_id)
         
         invocations = []
         paginator = ssm_client.get_paginator('list_command_invocations')
@@ -174,14 +198,14 @@ def get_command_invocations(ssm_client, command_id: str) -> List[Dict[str, Any]]
             page_invocations = page.get('CommandInvocations', [])
             invocations.extend(page_invocations)
         
-        logger.info(f"Found {len(invocations)} command invocations")
+        logger.info("Found %d command invocations", len(invocations))
         return invocations
         
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', 'Unknown')
         error_message = e.response.get('Error', {}).get('Message', str(e))
         
-        logger.error(f"Failed to get command invocations: {error_code} - {error_message}")
+        logger.error("Failed to get command invocations: %s - %s", error_code, error_message)
         
         if error_code == 'InvalidCommandId':
             raise SSMPollingError(f"Command not found: {command_id}")
@@ -316,7 +340,7 @@ def persist_outputs(ssm_client, command_id: str, bucket: str, prefix: str, invoc
             try:
                 resp = ssm_client.get_command_invocation(CommandId=command_id, InstanceId=instance_id, PluginName='aws:runPowerShellScript')
             except Exception as e:
-                logger.warning(f"Failed to get command invocation output for {instance_id}: {e}")
+                logger.warning("Failed to get command invocation output for %s: %s", instance_id, e)
                 continue
         stdout = resp.get('StandardOutputContent', '')
         stderr = resp.get('StandardErrorContent', '')
@@ -331,22 +355,27 @@ def persist_outputs(ssm_client, command_id: str, bucket: str, prefix: str, invoc
                 'execution_elapsed_millis': resp.get('ExecutionElapsedTime'),
                 'plugin_name': resp.get('PluginName')
             }
-            s3_client.put_object(Bucket=bucket, Key=f"{base}/meta.json", Body=json.dumps(meta, indent=2).encode('utf-8'), ContentType='application/json')
+            s3_client.put_object(Bucket=bucket, Key=f"{base}/meta.json", Body=json.dumps(meta, **_JSON_FORMAT).encode('utf-8'), ContentType='application/json')
             saved[instance_id] = { 'stdout': f"s3://{bucket}/{base}/stdout.txt", 'stderr': f"s3://{bucket}/{base}/stderr.txt" }
         except Exception as e:
-            logger.warning(f"Failed to store outputs for {instance_id} to S3: {e}")
+            logger.warning("Failed to store outputs for %s to S3: %s", instance_id, e)
             continue
     return { 'saved': saved }
 
+def _elapsed_ms(start_ns: int) -> float:
+    return (time.perf_counter_ns() - start_ns) / 1e6
+
 @with_correlation_id
 def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
     """
     Enhanced SSM command polling handler with comprehensive status tracking
     """
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     
     try:
-        logger.info(f"Starting SSM command polling with event: {json.dumps({k: v for k, v in event.items() if k not in ['cmd']}, default=str)}")
+        # Serializing the event is only worth it when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Starting SSM command polling with event: %s", json.dumps({k: v for k, v in event.items() if k != 'cmd'}, default=str))
         
         # Validate input
         validated_data = validate_input(event)
@@ -357,7 +386,7 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         execution_id = validated_data['execution_id']
         external_id = validated_data['external_id']
         
-        logger.info(f"Polling command {command_id} in account {account_id}, region {region}")
+        logger.info("Polling command %s in account %s, region %s", command_id, account_id, region)
         
         # Assume cross-account role
         credentials = assume_cross_account_role(role_arn, account_id, external_id)
@@ -383,15 +412,15 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
                     invocations,
                 )
             except Exception as pe:
-                logger.warning(f"Failed persisting outputs to S3: {pe}")
+                logger.warning("Failed persisting outputs to S3: %s", pe)
         
-        execution_time = time.time() - start_time
+        execution_time_ms = _elapsed_ms(start_ns)
         
         result = {
             'statusCode': 200,
             'success': True,
             **status_analysis,
-            'execution_time_ms': execution_time * 1000,
+            'execution_time_ms': execution_time_ms,
             'timestamp': time.time(),
             'account_id': account_id,
             'region': region,
@@ -399,19 +428,18 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'persisted': persisted
         }
         
-        logger.info(f"SSM polling completed in {execution_time:.2f}s")
-        logger.info(f"Status: {status_analysis['status']}, All done: {status_analysis['all_done']}")
-        logger.info(f"Progress: {status_analysis['completed_instances']}/{status_analysis['total_instances']} instances")
+        logger.info("SSM polling completed in %.2fs", execution_time_ms / 1000)
+        logger.info("Status: %s, All done: %s", status_analysis['status'], status_analysis['all_done'])
+        logger.info("Progress: %d/%d instances", status_analysis['completed_instances'], status_analysis['total_instances'])
         
         # Log warnings for high failure rates
         if status_analysis['failure_rate'] > 20:
-            logger.warning(f"High failure rate detected: {status_analysis['failure_rate']}%")
+            logger.warning("High failure rate detected: %s%%", status_analysis['failure_rate'])
         
         return result
         
     except SSMPollingError as e:
-        logger.error(f"SSM polling error: {str(e)}")
-        execution_time = time.time() - start_time
+        logger.error("SSM polling error: %s", e)
         
         return {
             'statusCode': 400,
@@ -420,13 +448,12 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'error_type': 'SSMPollingError',
             'all_done': False,
             'should_continue_polling': False,
-            'execution_time_ms': execution_time * 1000,
+            'execution_time_ms': _elapsed_ms(start_ns),
             'timestamp': time.time()
         }
     
     except Exception as e:
-        logger.error(f"Unexpected error in SSM polling handler: {str(e)}")
-        execution_time = time.time() - start_time
+        logger.error("Unexpected error in SSM polling handler: %s", e)
         
         return {
             'statusCode': 500,
@@ -435,6 +462,6 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'error_type': 'UnexpectedError',
             'all_done': False,
             'should_continue_polling': False,
-            'execution_time_ms': execution_time * 1000,
+            'execution_time_ms': _elapsed_ms(start_ns),
             'timestamp': time.time()
         }
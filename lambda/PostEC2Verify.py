@@ -1,13 +1,32 @@
 import os
+import re
 import json
+import gzip
+import tempfile
 import boto3
 import uuid
 import time
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List, Tuple
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Iterator, BinaryIO
+from decimal import Decimal
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
 from botocore.exceptions import ClientError, BotoCoreError
-from functools import wraps
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+
+# orjson is optional; it is not part of the Lambda artifact unless vendored into it
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str)
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8')
 
 # Configure structured logging
 logging.basicConfig(
@@ -16,10 +35,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamp each log record with the current invocation's correlation ID"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _correlation_id.get()
+        return True
+
+for _log_handler in logging.getLogger().handlers:
+    _log_handler.addFilter(CorrelationIdFilter())
+
 # Constants for CloudWatch custom metrics
 METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "EC2Patching/Orchestrator")
 NAME_PREFIX = os.environ.get("NAME_PREFIX", "ec2-patch")
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+# Base metric dimensions; per-region metrics append AccountId and Region
+_DIMS_BASE = (
+    {"Name": "NamePrefix", "Value": NAME_PREFIX},
+    {"Name": "Environment", "Value": ENVIRONMENT},
+)
+
+# Deployment configuration, read once per container
+S3_BUCKET = os.environ.get('S3_BUCKET')
+DDB_TABLE = os.environ.get('DDB_TABLE')
+DEFAULT_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+_TTL_SECONDS = 90 * 24 * 3600  # summaries expire after 90 days
+
+# Problematic instances kept in full detail per account-region
+MAX_ISSUE_DETAILS = int(os.environ.get('MAX_ISSUE_DETAILS', '100'))
+
+_ACCOUNT_RE = re.compile(r'[0-9]{12}\Z')
+_REGION_RE = re.compile(r'[a-z]{2}(-[a-z]+)+-[0-9]+\Z')
+# Compressed result spools stay in memory up to this size before spilling to /tmp
+S3_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+# Upper bound on concurrent account-region verifications
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "32"))
+
+# Assumed-role credentials keyed by (account_id, role_name) -> (credentials, expiry epoch).
+# Lives at module scope so warm invocations reuse still-valid sessions.
+CREDENTIAL_REFRESH_MARGIN = 300
+# Fixed session name; CloudTrail still distinguishes sessions by their access key
+ROLE_SESSION_NAME = 'PostEC2Verify'
+_CREDS_CACHE: Dict[Tuple[str, str], Tuple[Dict[str, str], float]] = {}
+_CREDS_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_CREDS_LOCKS_GUARD = threading.Lock()
+
+# SSM clients keyed by (access key id, region) -> (client, credential expiry epoch)
+_SSM_CLIENTS: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+_SSM_CLIENTS_LOCK = threading.Lock()
+
+# botocore's adaptive retry mode handles backoff, jitter and client-side rate limiting.
+# The connection pool is sized so every fan-out worker keeps its own kept-alive socket.
+_BOTO_CFG = Config(
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+    max_pool_connections=max(64, MAX_WORKERS),
+    tcp_keepalive=True
+)
+# SSM paginates long result streams; fail fast on connect, allow slower reads
+_SSM_CFG = _BOTO_CFG.merge(Config(connect_timeout=5, read_timeout=30))
+
+# Global clients, reused across warm invocations. Summaries are batched across the
+# fan-out and written with the low-level DynamoDB client.
+sts_client = boto3.client('sts', config=_BOTO_CFG)
+s3_client = boto3.client('s3', config=_BOTO_CFG)
+cloudwatch_client = boto3.client('cloudwatch', config=_BOTO_CFG)
+dynamodb_client = boto3.client('dynamodb', config=_BOTO_CFG)
+_ddb_serializer = TypeSerializer()
+DDB_BATCH_SIZE = 25  # BatchWriteItem limit
+DDB_MAX_ATTEMPTS = 5
+SSM_PAGE_SIZE = 50  # DescribeInstanceInformation MaxResults / DescribeInstancePatchStates InstanceIds limit
+# Patch-state fields read by analyze_patch_states or worth keeping in the S3 snapshot
+_PATCH_STATE_KEYS = (
+    'InstanceId', 'PatchGroup', 'BaselineId', 'MissingCount', 'FailedCount', 'NotApplicableCount',
+    'InstalledCount', 'InstalledOtherCount', 'InstalledPendingRebootCount',
+    'Operation', 'OperationStartTime', 'OperationEndTime'
+)
+CLOUDWATCH_BATCH_SIZE = 1000  # PutMetricData limit
 
 class PostVerificationError(Exception):
     """Custom exception for post-patching verification operations"""
@@ -29,50 +121,14 @@ def with_correlation_id(func):
     """Decorator to add correlation ID to all log messages"""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        correlation_id = str(uuid.uuid4())[:8]
-        
-        old_factory = logging.getLogRecordFactory()
-        def record_factory(*args, **kwargs):
-            record = old_factory(*args, **kwargs)
-            record.correlation_id = correlation_id
-            return record
-        
-        logging.setLogRecordFactory(record_factory)
-        
+        token = _correlation_id.set(uuid.uuid4().hex[:8])
         try:
             return func(*args, **kwargs)
         finally:
-            logging.setLogRecordFactory(old_factory)
-    
+            _correlation_id.reset(token)
     return wrapper
 
-def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0):
-    """Decorator for retry logic with exponential backoff"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except (ClientError, BotoCoreError) as e:
-                    error_code = e.response.get('Error', {}).get('Code', 'Unknown') if hasattr(e, 'response') else 'Unknown'
-                    
-                    if attempt == max_retries - 1:
-                        logger.error(f"Final retry failed for {func.__name__}: {error_code} - {str(e)}")
-                        raise
-                    
-                    if error_code in ['ValidationException', 'AccessDenied', 'InvalidInstanceId']:
-                        logger.error(f"Non-retryable error: {error_code}")
-                        raise
-                    
-                    delay = base_delay * (2 ** attempt)
-                    logger.warning(f"Retry {attempt + 1}/{max_retries} for {func.__name__} after {delay}s: {error_code}")
-                    time.sleep(delay)
-            return None
-        return wrapper
-    return decorator
-
-def validate_input(event: Dict[str, Any]) -> Dict[str, Any]:
+def validate_input(event: Dict[str, Any], now: int) -> Dict[str, Any]:
     """Validate and extract required parameters from event"""
     
     # Get accounts from event
@@ -80,106 +136,157 @@ def validate_input(event: Dict[str, Any]) -> Dict[str, Any]:
     if not accounts or not isinstance(accounts, list):
         raise PostVerificationError("Missing or invalid accounts list")
     
-    # Validate account IDs format
-    for account in accounts:
-        if not isinstance(account, str) or not account.isdigit() or len(account) != 12:
-            raise PostVerificationError(f"Invalid account ID format: {account}")
+    # Validate account IDs format, failing on the first bad entry
+    bad_account = next((a for a in accounts if not (isinstance(a, str) and _ACCOUNT_RE.match(a))), None)
+    if bad_account is not None:
+        raise PostVerificationError(f"Invalid account ID format: {bad_account}")
     
     # Get regions with fallback
-    regions = event.get('regions', [os.environ.get('AWS_REGION', 'us-east-1')])
+    regions = event.get('regions', [DEFAULT_REGION])
     if not isinstance(regions, list):
         regions = [regions]
+    bad_region = next((r for r in regions if not (isinstance(r, str) and _REGION_RE.match(r))), None)
+    if bad_region is not None:
+        raise PostVerificationError(f"Invalid region format: {bad_region}")
     
     # Validate required environment variables
-    bucket_name = os.environ.get('S3_BUCKET')
-    if not bucket_name:
+    if not S3_BUCKET:
         raise PostVerificationError("S3_BUCKET environment variable not set")
     
-    ddb_table = os.environ.get('DDB_TABLE')
-    if not ddb_table:
+    if not DDB_TABLE:
         raise PostVerificationError("DDB_TABLE environment variable not set")
     
-    execution_id = event.get('executionId', f'exec-{int(time.time())}')
+    execution_id = event.get('executionId', f'exec-{now}')
     
     return {
         'accounts': accounts,
         'regions': regions,
-        'bucket_name': bucket_name,
-        'ddb_table': ddb_table,
+        'bucket_name': S3_BUCKET,
+        'ddb_table': DDB_TABLE,
         'execution_id': execution_id
     }
 
+@lru_cache(maxsize=None)
+def _role_arn(account_id: str, role_name: str) -> str:
+    return f"arn:aws:iam::{account_id}:role/{role_name}"
+
 def assume_cross_account_role(account_id: str, role_name: str = 'PatchExecRole') -> Dict[str, str]:
-    """Assume cross-account role with comprehensive error handling"""
+    """Assume cross-account role with comprehensive error handling.
+
+    Credentials are cached per (account, role) and reused until they are within
+    CREDENTIAL_REFRESH_MARGIN seconds of expiring, so each account is assumed once
+    per warm container rather than once per region.
+    """
     
-    role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
-    session_name = f'PostEC2Verify-{int(time.time())}'
+    cache_key = (account_id, role_name)
+    with _CREDS_LOCKS_GUARD:
+        lock = _CREDS_LOCKS.setdefault(cache_key, threading.Lock())
     
-    try:
-        sts_client = boto3.client('sts')
-        
-        logger.info(f"Assuming role {role_arn}")
+    # Per-key lock: concurrent regions of one account wait for a single AssumeRole call
+    with lock:
+        cached = _CREDS_CACHE.get(cache_key)
+        if cached and cached[1] - time.time() > CREDENTIAL_REFRESH_MARGIN:
+            return cached[0]
         
-        response = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName=session_name,
-            DurationSeconds=3600  # 1 hour
-        )
-        
-        credentials = response['Credentials']
-        
-        logger.info(f"Successfully assumed role for account {account_id}")
-        
-        return {
-            'AccessKeyId': credentials['AccessKeyId'],
-            'SecretAccessKey': credentials['SecretAccessKey'],
-            'SessionToken': credentials['SessionToken'],
-            'Expiration': credentials['Expiration'].isoformat()
-        }
+        role_arn = _role_arn(account_id, role_name)
         
-    except ClientError as e:
-        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-        error_message = e.response.get('Error', {}).get('Message', str(e))
+        try:
+            logger.info(f"Assuming role {role_arn}")
+            
+            response = sts_client.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=ROLE_SESSION_NAME,
+                DurationSeconds=3600  # 1 hour
+            )
+            
+            credentials = response['Credentials']
+            
+            logger.info(f"Successfully assumed role for account {account_id}")
+            
+            result = {
+                'AccessKeyId': credentials['AccessKeyId'],
+                'SecretAccessKey': credentials['SecretAccessKey'],
+                'SessionToken': credentials['SessionToken'],
+                'Expiration': credentials['Expiration'].isoformat()
+            }
+            _CREDS_CACHE[cache_key] = (result, credentials['Expiration'].timestamp())
+            return result
+            
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+            error_message = e.response.get('Error', {}).get('Message', str(e))
+            
+            logger.error(f"Failed to assume role {role_arn}: {error_code} - {error_message}")
+            
+            if error_code == 'AccessDenied':
+                raise PostVerificationError(f"Access denied assuming role in account {account_id}: {error_message}")
+            elif error_code == 'InvalidUserType':
+                raise PostVerificationError(f"Invalid user type for role assumption: {error_message}")
+            else:
+                raise PostVerificationError(f"Role assumption failed [{error_code}]: {error_message}")
+
+def _ssm_client(credentials: Dict[str, str], region: str) -> Any:
+    """Return a cached SSM client for these assumed-role credentials in `region`.
+
+    Entries are keyed by access key, so refreshed credentials get a new client;
+    clients whose credentials have expired are evicted on the next miss.
+    """
+    cache_key = (credentials['AccessKeyId'], region)
+    with _SSM_CLIENTS_LOCK:
+        cached = _SSM_CLIENTS.get(cache_key)
+        if cached:
+            return cached[0]
         
-        logger.error(f"Failed to assume role {role_arn}: {error_code} - {error_message}")
+        now = time.time()
+        for stale_key in [key for key, (_, expiry) in _SSM_CLIENTS.items() if expiry <= now]:
+            del _SSM_CLIENTS[stale_key]
         
-        if error_code == 'AccessDenied':
-            raise PostVerificationError(f"Access denied assuming role in account {account_id}: {error_message}")
-        elif error_code == 'InvalidUserType':
-            raise PostVerificationError(f"Invalid user type for role assumption: {error_message}")
-        else:
-            raise PostVerificationError(f"Role assumption failed [{error_code}]: {error_message}")
-
-@retry_with_backoff(max_retries=3, base_delay=2.0)
-def get_patch_states(credentials: Dict[str, str], region: str) -> List[Dict[str, Any]]:
-    """Get patch states for all instances in region with comprehensive error handling"""
-    
-    try:
         ssm_client = boto3.client(
             'ssm',
             region_name=region,
             aws_access_key_id=credentials['AccessKeyId'],
             aws_secret_access_key=credentials['SecretAccessKey'],
-            aws_session_token=credentials['SessionToken']
+            aws_session_token=credentials['SessionToken'],
+            config=_SSM_CFG
         )
+        _SSM_CLIENTS[cache_key] = (ssm_client, datetime.fromisoformat(credentials['Expiration']).timestamp())
+        return ssm_client
+
+def get_patch_states(credentials: Dict[str, str], region: str) -> Iterator[Dict[str, Any]]:
+    """Yield patch states for all instances in region, page by page, with comprehensive error handling"""
+    
+    try:
+        ssm_client = _ssm_client(credentials, region)
         
         logger.info(f"Retrieving patch states for region {region}")
         
+        # DescribeInstancePatchStates requires InstanceIds (at most 50 per call), so list
+        # the managed instances first, 50 per page, then fetch their states in batches
+        info_paginator = ssm_client.get_paginator('describe_instance_information')
+        instance_ids = [
+            info['InstanceId']
+            for page in info_paginator.paginate(PaginationConfig={'PageSize': SSM_PAGE_SIZE})
+            for info in page.get('InstanceInformationList', [])
+        ]
+        
         paginator = ssm_client.get_paginator('describe_instance_patch_states')
-        all_states = []
+        state_count = 0
         
-        # Get all patch states
+        # Get all patch states, keeping only the fields analysis and storage use
         page_count = 0
-        for page in paginator.paginate():
-            page_count += 1
-            states = page.get('InstancePatchStates', [])
-            all_states.extend(states)
-            
-            logger.debug(f"Retrieved page {page_count} with {len(states)} patch states")
-        
-        logger.info(f"Retrieved {len(all_states)} patch states from region {region}")
+        for start in range(0, len(instance_ids), SSM_PAGE_SIZE):
+            batch = instance_ids[start:start + SSM_PAGE_SIZE]
+            for page in paginator.paginate(InstanceIds=batch, PaginationConfig={'PageSize': SSM_PAGE_SIZE}):
+                page_count += 1
+                states = page.get('InstancePatchStates', [])
+                state_count += len(states)
+                
+                logger.debug("Retrieved page %d with %d patch states", page_count, len(states))
+                
+                for state in states:
+                    yield {key: state[key] for key in _PATCH_STATE_KEYS if key in state}
         
-        return all_states
+        logger.info(f"Retrieved {state_count} patch states from region {region}")
         
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', 'Unknown')
@@ -194,10 +301,45 @@ def get_patch_states(credentials: Dict[str, str], region: str) -> List[Dict[str,
         else:
             raise PostVerificationError(f"SSM describe_instance_patch_states failed [{error_code}]: {error_message}")
 
-def analyze_patch_states(patch_states: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Analyze patch states to identify issues and generate comprehensive stats"""
+def analyze_patch_states(patch_states: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Analyze patch states to identify issues and generate comprehensive stats.
+
+    Accepts any iterable, so states can be analysed as they stream in from SSM.
+    """
+    
+    total_instances = 0
+    problematic_instances = 0
+    issues_found = []
+    append_issue = issues_found.append
+    high_severity = 0
+    
+    # Single pass: only instances with missing or failed patches need the full detail
+    for state in patch_states:
+        total_instances += 1
+        get = state.get
+        missing_count = get('MissingCount', 0)
+        failed_count = get('FailedCount', 0)
+        
+        if missing_count > 0 or failed_count > 0:
+            problematic_instances += 1
+            if failed_count > 0:
+                high_severity += 1
+            # Counts stay exact; per-instance detail is bounded (the full states are in S3)
+            if problematic_instances > MAX_ISSUE_DETAILS:
+                continue
+            append_issue({
+                'instance_id': get('InstanceId', 'unknown'),
+                'missing_count': missing_count,
+                'failed_count': failed_count,
+                'installed_count': get('InstalledCount', 0),
+                'installed_pending_reboot': get('InstalledPendingRebootCount', 0),
+                'operation': get('Operation', 'Unknown'),
+                'operation_start': get('OperationStartTime', 'Unknown'),
+                'operation_end': get('OperationEndTime', 'Unknown'),
+                'severity': 'high' if failed_count > 0 else 'medium'
+            })
     
-    if not patch_states:
+    if total_instances == 0:
         return {
             'total_instances': 0,
             'healthy_instances': 0,
@@ -207,48 +349,13 @@ def analyze_patch_states(patch_states: List[Dict[str, Any]]) -> Dict[str, Any]:
             'analysis': 'No instances found'
         }
     
-    total_instances = len(patch_states)
-    issues_found = []
-    
-    # Analyze each instance
-    for state in patch_states:
-        instance_id = state.get('InstanceId', 'unknown')
-        missing_count = state.get('MissingCount', 0)
-        failed_count = state.get('FailedCount', 0)
-        not_applicable_count = state.get('NotApplicableCount', 0)
-        installed_count = state.get('InstalledCount', 0)
-        installed_other_count = state.get('InstalledOtherCount', 0)
-        installed_pending_reboot_count = state.get('InstalledPendingRebootCount', 0)
-        operation = state.get('Operation', 'Unknown')
-        operation_start_time = state.get('OperationStartTime', 'Unknown')
-        operation_end_time = state.get('OperationEndTime', 'Unknown')
-        
-        # Check for issues
-        has_issues = missing_count > 0 or failed_count > 0
-        
-        if has_issues:
-            issue_detail = {
-                'instance_id': instance_id,
-                'missing_count': missing_count,
-                'failed_count': failed_count,
-                'installed_count': installed_count,
-                'installed_pending_reboot': installed_pending_reboot_count,
-                'operation': operation,
-                'operation_start': operation_start_time,
-                'operation_end': operation_end_time,
-                'severity': 'high' if failed_count > 0 else 'medium'
-            }
-            issues_found.append(issue_detail)
-    
-    healthy_instances = total_instances - len(issues_found)
-    problematic_instances = len(issues_found)
-    success_rate = (healthy_instances / total_instances) * 100 if total_instances > 0 else 0.0
+    healthy_instances = total_instances - problematic_instances
+    success_rate = (healthy_instances / total_instances) * 100
     
     # Generate summary analysis
     if problematic_instances == 0:
         analysis = f"All {total_instances} instances patched successfully"
     else:
-        high_severity = sum(1 for issue in issues_found if issue['severity'] == 'high')
         medium_severity = problematic_instances - high_severity
         
         analysis_parts = [f"{problematic_instances}/{total_instances} instances have issues"]
@@ -268,30 +375,32 @@ def analyze_patch_states(patch_states: List[Dict[str, Any]]) -> Dict[str, Any]:
         'analysis': analysis
     }
 
-@retry_with_backoff(max_retries=3, base_delay=1.0)
-def store_results_s3(bucket_name: str, s3_key: str, data: Dict[str, Any]) -> str:
-    """Store verification results in S3 with comprehensive error handling"""
+def _spill_states(patch_states: Iterable[Dict[str, Any]], stream: BinaryIO) -> Iterator[Dict[str, Any]]:
+    """Write each state to `stream` as a JSON line while passing it through"""
+    write = stream.write
+    for state in patch_states:
+        write(_dumps(state) + b'\n')
+        yield state
+
+def store_results_s3(bucket_name: str, s3_key: str, body: BinaryIO, metadata: Dict[str, str]) -> str:
+    """Upload a gzip-compressed JSON Lines spool to S3 with comprehensive error handling"""
     
     try:
-        s3_client = boto3.client('s3')
-        
-        # Convert data to JSON string with proper formatting
-        json_data = json.dumps(data, indent=2, default=str, sort_keys=True)
+        extra_args = {
+            'ContentType': 'application/x-ndjson',
+            'ContentEncoding': 'gzip',
+            'ServerSideEncryption': 'AES256',
+            'Metadata': {
+                'verification-type': 'post-patching',
+                **metadata
+            }
+        }
         
         logger.info(f"Storing results to S3: s3://{bucket_name}/{s3_key}")
         
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=json_data.encode('utf-8'),
-            ContentType='application/json',
-            ServerSideEncryption='AES256',
-            Metadata={
-                'verification-type': 'post-patching',
-                'timestamp': str(int(time.time())),
-                'instance-count': str(len(data.get('patch_states', [])))
-            }
-        )
+        # Managed transfer: single PUT for small spools, multipart above the threshold
+        body.seek(0)
+        s3_client.upload_fileobj(body, bucket_name, s3_key, ExtraArgs=extra_args)
         
         s3_url = f"s3://{bucket_name}/{s3_key}"
         logger.info(f"Successfully stored results: {s3_url}")
@@ -311,43 +420,73 @@ def store_results_s3(bucket_name: str, s3_key: str, data: Dict[str, Any]) -> str
         else:
             raise PostVerificationError(f"S3 storage failed [{error_code}]: {error_message}")
 
-@retry_with_backoff(max_retries=3, base_delay=1.0)
-def store_results_dynamodb(ddb_table: str, record: Dict[str, Any]) -> None:
-    """Store verification summary in DynamoDB with comprehensive error handling"""
+def _to_ddb_item(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Marshal a plain record into DynamoDB AttributeValues (floats become Decimal)"""
+    return {
+        key: _ddb_serializer.serialize(Decimal(str(value)) if isinstance(value, float) else value)
+        for key, value in record.items()
+    }
+
+def store_results_dynamodb(ddb_table: str, records: List[Dict[str, Any]], created_at: int) -> List[str]:
+    """Store verification summaries in DynamoDB with BatchWriteItem, 25 items per request.
+
+    UnprocessedItems are retried with exponential backoff. Returns the ids of records
+    that could not be written.
+    """
     
-    try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(ddb_table)
-        
-        logger.info(f"Storing summary to DynamoDB: {record['id']}")
-        
-        # Add timestamps
-        record['created_at'] = int(time.time())
-        record['ttl'] = int(time.time()) + (90 * 24 * 3600)  # 90 days TTL
-        
-        table.put_item(Item=record)
-        
-        logger.info(f"Successfully stored DynamoDB record: {record['id']}")
-        
-    except ClientError as e:
-        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-        error_message = e.response.get('Error', {}).get('Message', str(e))
-        
-        logger.error(f"Failed to store to DynamoDB: {error_code} - {error_message}")
-        
-        if error_code == 'ResourceNotFoundException':
-            raise PostVerificationError(f"DynamoDB table not found: {ddb_table}")
-        elif error_code == 'ValidationException':
-            raise PostVerificationError(f"Invalid DynamoDB record format: {error_message}")
-        else:
-            raise PostVerificationError(f"DynamoDB storage failed [{error_code}]: {error_message}")
+    ttl = created_at + _TTL_SECONDS
+    failed_ids: List[str] = []
+    
+    for start in range(0, len(records), DDB_BATCH_SIZE):
+        chunk = records[start:start + DDB_BATCH_SIZE]
+        requests = [{'PutRequest': {'Item': _to_ddb_item({**record, 'created_at': created_at, 'ttl': ttl})}} for record in chunk]
+        
+        logger.info(f"Storing {len(requests)} summaries to DynamoDB table {ddb_table}")
+        
+        for attempt in range(DDB_MAX_ATTEMPTS):
+            if attempt:
+                delay = 0.1 * (2 ** attempt)
+                logger.warning(f"Retrying {len(requests)} unprocessed DynamoDB items after {delay}s")
+                time.sleep(delay)
+            try:
+                response = dynamodb_client.batch_write_item(RequestItems={ddb_table: requests})
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+                error_message = e.response.get('Error', {}).get('Message', str(e))
+                
+                logger.error(f"Failed to store to DynamoDB: {error_code} - {error_message}")
+                
+                if error_code in ('ResourceNotFoundException', 'ValidationException', 'AccessDeniedException'):
+                    break
+                continue
+            except BotoCoreError as e:
+                # Connection/read failures after botocore's own retries: retry the chunk,
+                # then report its ids as failed rather than aborting the whole run
+                logger.error(f"Failed to store to DynamoDB: {str(e)}")
+                continue
+            requests = response.get('UnprocessedItems', {}).get(ddb_table, [])
+            if not requests:
+                break
+        
+        if requests:
+            failed_ids.extend(request['PutRequest']['Item']['id']['S'] for request in requests)
+    
+    logger.info(f"Stored {len(records) - len(failed_ids)}/{len(records)} DynamoDB summaries")
+    
+    return failed_ids
+
+def publish_metrics(metric_data: List[Dict[str, Any]]) -> None:
+    """Publish one PutMetricData batch of custom metrics"""
+    cloudwatch_client.put_metric_data(Namespace=METRICS_NAMESPACE, MetricData=metric_data)
+    logger.info(f"Published {len(metric_data)} metrics to CloudWatch")
 
 def process_account_region(
     account: str,
     region: str,
     bucket_name: str,
-    ddb_table: str,
-    execution_id: str
+    execution_id: str,
+    today: str,
+    now: int
 ) -> Dict[str, Any]:
     """Process verification for a single account-region combination"""
     
@@ -357,28 +496,43 @@ def process_account_region(
         # Assume role in target account
         credentials = assume_cross_account_role(account)
         
-        # Get patch states
-        patch_states = get_patch_states(credentials, region)
-        
-        # Analyze results
-        analysis = analyze_patch_states(patch_states)
-        
         # Generate S3 key
-        today = datetime.utcnow().strftime('%Y/%m/%d')
-        s3_key = f"{today}/{account}/{region}/post_ec2_patchstates.json"
-        
-        # Prepare data for storage
-        storage_data = {
-            'execution_id': execution_id,
-            'account_id': account,
-            'region': region,
-            'timestamp': datetime.utcnow().isoformat(),
-            'patch_states': patch_states,
-            'analysis': analysis
-        }
+        s3_key = f"{today}/{account}/{region}/post_ec2_patchstates.jsonl.gz"
         
-        # Store results in S3
-        s3_url = store_results_s3(bucket_name, s3_key, storage_data)
+        # Stream patch states page by page: analyse each one while spilling it as a
+        # JSON line into a gzip spool, so peak memory is bounded by the page size
+        with tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_MEMORY) as spool:
+            with gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=6) as gz:
+                analysis = analyze_patch_states(_spill_states(get_patch_states(credentials, region), gz))
+            
+            # Nothing to verify: skip the S3 snapshot and metrics, keep a marker record
+            # so downstream steps can still see the region was checked
+            if analysis['total_instances'] == 0:
+                logger.info(f"No managed instances in {account}:{region}; skipping storage and metrics")
+                return {
+                    'account': account,
+                    'region': region,
+                    'success': True,
+                    'skipped': True,
+                    'analysis': analysis,
+                    'ddb_record': {
+                        'scope': 'EC2#POST',
+                        'id': f'{account}:{region}:{today}',
+                        'execution_id': execution_id,
+                        'total_instances': 0,
+                        'analysis': analysis['analysis']
+                    },
+                    'metrics': []
+                }
+            
+            # Store results in S3; the summary analysis goes to DynamoDB
+            s3_url = store_results_s3(bucket_name, s3_key, spool, {
+                'execution-id': execution_id,
+                'timestamp': str(now),
+                'account-id': account,
+                'region': region,
+                'instance-count': str(analysis['total_instances'])
+            })
         
         # Prepare DynamoDB record
         ddb_record = {
@@ -393,41 +547,32 @@ def process_account_region(
             'analysis': analysis['analysis']
         }
         
-        # Store summary in DynamoDB
-        store_results_dynamodb(ddb_table, ddb_record)
-        
-        # Emit per-region custom metrics
-        try:
-            cw = boto3.client("cloudwatch")
-            dims = [
-                {"Name": "NamePrefix", "Value": NAME_PREFIX},
-                {"Name": "Environment", "Value": ENVIRONMENT},
-                {"Name": "AccountId", "Value": account},
-                {"Name": "Region", "Value": region},
-            ]
-            metrics = [
-                {
-                    "MetricName": "SuccessRate",
-                    "Dimensions": dims,
-                    "Unit": "Percent",
-                    "Value": float(analysis['success_rate'])
-                },
-                {
-                    "MetricName": "InstancesTotal",
-                    "Dimensions": dims,
-                    "Unit": "Count",
-                    "Value": float(analysis['total_instances'])
-                },
-                {
-                    "MetricName": "InstancesWithIssues",
-                    "Dimensions": dims,
-                    "Unit": "Count",
-                    "Value": float(analysis['problematic_instances'])
-                }
-            ]
-            cw.put_metric_data(Namespace=METRICS_NAMESPACE, MetricData=metrics)
-        except Exception as me:
-            logger.warning(f"Failed to publish metrics to CloudWatch for {account}:{region}: {me}")
+        # Per-region custom metrics; the handler publishes them in one batch
+        dims = [
+            *_DIMS_BASE,
+            {"Name": "AccountId", "Value": account},
+            {"Name": "Region", "Value": region},
+        ]
+        metrics = [
+            {
+                "MetricName": "SuccessRate",
+                "Dimensions": dims,
+                "Unit": "Percent",
+                "Value": float(analysis['success_rate'])
+            },
+            {
+                "MetricName": "InstancesTotal",
+                "Dimensions": dims,
+                "Unit": "Count",
+                "Value": float(analysis['total_instances'])
+            },
+            {
+                "MetricName": "InstancesWithIssues",
+                "Dimensions": dims,
+                "Unit": "Count",
+                "Value": float(analysis['problematic_instances'])
+            }
+        ]
 
         result = {
             'account': account,
@@ -435,7 +580,9 @@ def process_account_region(
             'success': True,
             'analysis': analysis,
             's3_key': s3_key,
-            's3_url': s3_url
+            's3_url': s3_url,
+            'ddb_record': ddb_record,
+            'metrics': metrics
         }
         
         # Add issue details if problems found
@@ -465,13 +612,20 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
     """
     Enhanced post-patching verification handler with comprehensive analysis
     """
-    start_time = time.time()
+    # Scheduled warm-up ping: return before any validation or AWS calls
+    if event.get('warmup'):
+        return {'statusCode': 200, 'warm': True}
+    
+    # One wall-clock read per invocation; durations use the monotonic clock
+    now = int(time.time())
+    today = time.strftime('%Y/%m/%d', time.gmtime(now))
+    start_time = time.monotonic()
     
     try:
         logger.info(f"Starting post-patching verification with event keys: {list(event.keys())}")
         
         # Validate input
-        validated_data = validate_input(event)
+        validated_data = validate_input(event, now)
         
         accounts = validated_data['accounts']
         regions = validated_data['regions']
@@ -481,40 +635,59 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         
         logger.info(f"Processing {len(accounts)} accounts across {len(regions)} regions")
         
-        results = []
         overall_issues = []
         total_instances = 0
         total_problematic = 0
         
-        # Process each account-region combination
-        for account in accounts:
-            for region in regions:
-                result = process_account_region(
-                    account, region, bucket_name, ddb_table, execution_id
-                )
-                
-                results.append(result)
+        # Process account-region combinations concurrently; the work is I/O bound
+        pairs = [(account, region) for account in accounts for region in regions]
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(pairs)))) as executor:
+            # copy_context() carries the correlation ID into each worker thread
+            futures = [
+                executor.submit(copy_context().run, process_account_region, account, region, bucket_name, execution_id, today, now)
+                for account, region in pairs
+            ]
+            results = [future.result() for future in futures]
+        
+        # One batched write for every successful account-region summary. Duplicate
+        # account/region inputs share a key, which BatchWriteItem rejects within a request.
+        summaries = [(result, result.pop('ddb_record')) for result in results if result['success']]
+        unique_records = {record['id']: record for _, record in summaries}
+        failed_ids = set(store_results_dynamodb(ddb_table, list(unique_records.values()), now)) if unique_records else set()
+        for result, record in summaries:
+            if record['id'] in failed_ids:
+                result.update({'success': False, 'error': f"DynamoDB summary write failed for {record['id']}", 'error_type': 'PostVerificationError'})
+        
+        # Metrics from every verified account-region, CLOUDWATCH_BATCH_SIZE per request
+        all_metrics = [metric for result, _ in summaries for metric in result.pop('metrics')]
+        for start in range(0, len(all_metrics), CLOUDWATCH_BATCH_SIZE):
+            try:
+                publish_metrics(all_metrics[start:start + CLOUDWATCH_BATCH_SIZE])
+            except Exception as me:
+                logger.warning(f"Failed to publish metrics to CloudWatch: {me}")
+        
+        for (account, region), result in zip(pairs, results):
+            if result['success']:
+                analysis = result['analysis']
+                total_instances += analysis['total_instances']
+                total_problematic += analysis['problematic_instances']
                 
-                if result['success']:
-                    analysis = result['analysis']
-                    total_instances += analysis['total_instances']
-                    total_problematic += analysis['problematic_instances']
-                    
-                    # Collect issues for overall summary
-                    if analysis['problematic_instances'] > 0:
-                        overall_issues.append({
-                            'account': account,
-                            'region': region,
-                            'count': analysis['problematic_instances'],
-                            's3_key': result['s3_key']
-                        })
+                # Collect issues for overall summary
+                if analysis['problematic_instances'] > 0:
+                    overall_issues.append({
+                        'account': account,
+                        'region': region,
+                        'count': analysis['problematic_instances'],
+                        's3_key': result['s3_key']
+                    })
         
         # Calculate overall statistics
         successful_processes = sum(1 for r in results if r['success'])
+        skipped_regions = sum(1 for r in results if r.get('skipped'))
         failed_processes = len(results) - successful_processes
         overall_success_rate = (total_instances - total_problematic) / total_instances * 100 if total_instances > 0 else 100.0
         
-        execution_time = time.time() - start_time
+        execution_time = time.monotonic() - start_time
         
         final_result = {
             'statusCode': 200,
@@ -524,6 +697,7 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
                 'total_processes': len(results),
                 'successful_processes': successful_processes,
                 'failed_processes': failed_processes,
+                'skipped_regions': skipped_regions,
                 'total_instances': total_instances,
                 'problematic_instances': total_problematic,
                 'overall_success_rate': round(overall_success_rate, 2)
@@ -531,7 +705,7 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'results': results,
             'execution_id': execution_id,
             'execution_time_ms': round(execution_time * 1000, 2),
-            'timestamp': time.time()
+            'timestamp': now
         }
         
         logger.info(f"Post-verification completed in {execution_time:.2f}s")
@@ -541,7 +715,7 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         
     except PostVerificationError as e:
         logger.error(f"Post-verification error: {str(e)}")
-        execution_time = time.time() - start_time
+        execution_time = time.monotonic() - start_time
         
         return {
             'statusCode': 400,
@@ -549,12 +723,12 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'error': str(e),
             'error_type': 'PostVerificationError',
             'execution_time_ms': round(execution_time * 1000, 2),
-            'timestamp': time.time()
+            'timestamp': now
         }
     
     except Exception as e:
         logger.error(f"Unexpected error in post-verification handler: {str(e)}")
-        execution_time = time.time() - start_time
+        execution_time = time.monotonic() - start_time
         
         return {
             'statusCode': 500,
@@ -562,5 +736,5 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'error': f"Unexpected error: {str(e)}",
             'error_type': 'UnexpectedError',
             'execution_time_ms': round(execution_time * 1000, 2),
-            'timestamp': time.time()
+            'timestamp': now
         }
@@ -37,6 +37,9 @@ dynamodb = boto3.resource(
     )
 )
 
+# S3 snapshots are machine-consumed: compact JSON unless PRETTY_JSON=1 is set for debugging
+_JSON_FORMAT = {'indent': 2} if os.environ.get('PRETTY_JSON') == '1' else {'separators': (',', ':')}
+
 class PatchingError(Exception):
     """Custom exception for EC2 patching operations"""
     pass
@@ -292,7 +295,7 @@ def store_inventory_data(inventory: Dict, s3_key: str, account: str, region: str
         s3_client.put_object(
             Bucket=bucket_name,
             Key=s3_key,
-            Body=json.dumps(enriched_inventory, indent=2, default=str),
+            Body=json.dumps(enriched_inventory, default=str, **_JSON_FORMAT),
             ContentType='application/json',
             ServerSideEncryption='AES256',
             Metadata={
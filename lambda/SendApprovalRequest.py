@@ -1,19 +1,39 @@
-# Copied and updated with HMAC signing; Slack sends via urllib
+# Copied and updated with HMAC signing; Slack sends via pooled urllib3 (urllib fallback)
 import os
 import json
 import boto3
 import uuid
 import time
+import random
 import logging
 import urllib.parse
 import hmac
 import hashlib
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, NamedTuple
 from botocore.exceptions import ClientError, BotoCoreError
 from functools import wraps
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
 import urllib.request
 
+# urllib3 ships with botocore, so it is present wherever boto3 is; a module-level
+# pool keeps the Slack TLS connection alive across warm invocations.
+try:
+    import urllib3
+    _HTTP = urllib3.PoolManager(num_pools=4, maxsize=4, timeout=urllib3.Timeout(total=10.0), retries=False)
+except ImportError:  # pragma: no cover - exercised when urllib3 is not installed
+    _HTTP = None
+
+# orjson is optional; it is not part of the Lambda artifact unless vendored into it
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str)
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8')
+
 # Configure structured logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,27 +41,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamp each log record with the current invocation's correlation ID"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _correlation_id.get()
+        return True
+
+for _log_handler in logging.getLogger().handlers:
+    _log_handler.addFilter(CorrelationIdFilter())
+
+# Deployment configuration, read once per container
+TOPIC_ARN = os.environ.get('TOPIC_ARN')
+APIGW_BASE = os.environ.get('APIGW_BASE')
+SLACK_WEBHOOK_URL = os.environ.get('SLACK_WEBHOOK_URL', '')
+APPROVAL_SIGNING_SECRET_ARN = os.environ.get('APPROVAL_SIGNING_SECRET_ARN')
+
+# Clients and the resolved signing secret live for the container lifetime so
+# warm invocations skip client construction and the Secrets Manager round-trip.
+_SNS = boto3.client('sns')
+_SM_CLIENT = None
+SIGNING_SECRET_TTL_SECONDS = 300
+_SIGNING_SECRET_CACHE: Dict[str, Any] = {'value': None, 'expires': 0.0}
+# Keyed HMAC for the cached secret; rebuilt only when the secret is refetched
+_HMAC_TEMPLATE: Dict[str, Any] = {'key': None, 'mac': None}
+# RFC 3986 unreserved characters: quote(..., safe='') leaves these untouched, so
+# tokens made only of them can skip the pure-Python encoder.
+_UNRESERVED_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+
+# Approval notification body; per-request values are filled in with format_map
+_MESSAGE_TEMPLATE = """APPROVAL REQUIRED: EC2 Patching Operation
+
+Execution Information:
+• Execution ID: {execution_id}
+• Request Time: {current_time}
+• Estimated Duration: {duration_text}
+• Request ID: {task_token_hash}
+
+Operation Details:
+{details}
+
+ACTIONS REQUIRED:
+APPROVE: {approve_url}
+REJECT:  {reject_url}
+
+Notes:
+• Approval will expire after 1 hour
+• All operations are logged and audited"""
+
 class ApprovalRequestError(Exception):
     pass
 
+class ApprovalRequest(NamedTuple):
+    task_token: str
+    subject: str
+    details: Dict[str, Any]
+    topic_arn: str
+    apigw_base: str
+    execution_id: str
+    estimated_duration: Any
+
 def with_correlation_id(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        correlation_id = str(uuid.uuid4())[:8]
-        old_factory = logging.getLogRecordFactory()
-        def record_factory(*args, **kwargs):
-            record = old_factory(*args, **kwargs)
-            record.correlation_id = correlation_id
-            return record
-        logging.setLogRecordFactory(record_factory)
+        token = _correlation_id.set(uuid.uuid4().hex[:8])
         try:
             return func(*args, **kwargs)
         finally:
-            logging.setLogRecordFactory(old_factory)
+            _correlation_id.reset(token)
     return wrapper
 
 def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0):
     def decorator(func):
+        if max_retries <= 1:
+            return func
         @wraps(func)
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
@@ -50,51 +124,48 @@ def retry_with_backoff(max_retries: int = 3, base_delay: float = 1.0):
                 except (ClientError, BotoCoreError) as e:
                     error_code = e.response.get('Error', {}).get('Code', 'Unknown') if hasattr(e, 'response') else 'Unknown'
                     if attempt == max_retries - 1:
-                        logger.error(f"Final retry failed for {func.__name__}: {error_code} - {str(e)}")
+                        logger.error("Final retry failed for %s: %s - %s", func.__name__, error_code, e)
                         raise
                     if error_code in ['ValidationException', 'SubscriptionRequiredException']:
-                        logger.error(f"Non-retryable error: {error_code}")
+                        logger.error("Non-retryable error: %s", error_code)
                         raise
-                    delay = base_delay * (2 ** attempt)
-                    logger.warning(f"Retry {attempt + 1}/{max_retries} for {func.__name__} after {delay}s: {error_code}")
+                    # Full jitter keeps concurrent executions from retrying in lockstep
+                    delay = random.uniform(0, base_delay * (2 ** attempt))
+                    logger.warning("Retry %d/%d for %s after %.2fs: %s", attempt + 1, max_retries, func.__name__, delay, error_code)
                     time.sleep(delay)
             return None
         return wrapper
     return decorator
 
-def validate_input(event: Dict[str, Any]) -> Dict[str, Any]:
+def validate_input(event: Dict[str, Any]) -> ApprovalRequest:
     if 'taskToken' not in event:
         raise ApprovalRequestError("Missing required field: taskToken")
     task_token = event['taskToken']
     if not task_token or not isinstance(task_token, str):
         raise ApprovalRequestError("Invalid task token")
-    topic_arn = os.environ.get('TOPIC_ARN')
-    if not topic_arn:
+    if not TOPIC_ARN:
         raise ApprovalRequestError("TOPIC_ARN environment variable not set")
-    apigw_base = os.environ.get('APIGW_BASE')
-    if not apigw_base:
+    if not APIGW_BASE:
         raise ApprovalRequestError("APIGW_BASE environment variable not set")
     subject = event.get('subject', 'EC2 Patching Approval Required')
     details = event.get('details', {})
     execution_id = event.get('executionId', 'unknown')
     estimated_duration = event.get('estimatedDuration', 'unknown')
-    return {
-        'task_token': task_token,
-        'subject': subject,
-        'details': details,
-        'topic_arn': topic_arn,
-        'apigw_base': apigw_base,
-        'execution_id': execution_id,
-        'estimated_duration': estimated_duration
-    }
+    return ApprovalRequest(task_token, subject, details, TOPIC_ARN, APIGW_BASE, execution_id, estimated_duration)
+
+def _get_sm_client():
+    global _SM_CLIENT
+    if _SM_CLIENT is None:
+        _SM_CLIENT = boto3.client('secretsmanager')
+    return _SM_CLIENT
 
-def _get_signing_secret() -> Optional[str]:
-    secret_arn = os.environ.get('APPROVAL_SIGNING_SECRET_ARN')
-    if not secret_arn:
+def _get_signing_secret() -> Optional[bytes]:
+    if not APPROVAL_SIGNING_SECRET_ARN:
         return None
+    if _SIGNING_SECRET_CACHE['value'] and time.time() < _SIGNING_SECRET_CACHE['expires']:
+        return _SIGNING_SECRET_CACHE['value']
     try:
-        sm = boto3.client('secretsmanager')
-        resp = sm.get_secret_value(SecretId=secret_arn)
+        resp = _get_sm_client().get_secret_value(SecretId=APPROVAL_SIGNING_SECRET_ARN)
         val = resp.get('SecretString')
         if not val and 'SecretBinary' in resp:
             val = resp['SecretBinary'].decode('utf-8')
@@ -103,32 +174,43 @@ def _get_signing_secret() -> Optional[str]:
             val = parsed.get('secret') or parsed.get('value') or val
         except Exception:
             pass
-        return val
+        _SIGNING_SECRET_CACHE['value'] = val.encode('utf-8')
+        _SIGNING_SECRET_CACHE['expires'] = time.time() + SIGNING_SECRET_TTL_SECONDS
+        return _SIGNING_SECRET_CACHE['value']
     except Exception as e:
-        logger.warning(f"Failed to retrieve signing secret: {str(e)}")
+        logger.warning("Failed to retrieve signing secret: %s", e)
         return None
 
+def _get_hmac_template() -> Optional["hmac.HMAC"]:
+    # Inner/outer pads are absorbed once per secret; callers .copy() the template.
+    secret = _get_signing_secret()
+    if not secret:
+        return None
+    if _HMAC_TEMPLATE['key'] is not secret:
+        _HMAC_TEMPLATE['mac'] = hmac.new(secret, digestmod=hashlib.sha256)
+        _HMAC_TEMPLATE['key'] = secret
+    return _HMAC_TEMPLATE['mac']
+
 def _build_canonical_string(token: str, timestamp: int, action: str, execution_id: str) -> str:
     return f"{token}:{timestamp}:{action}:{execution_id}"
 
-def _sign(canonical: str, secret: str) -> str:
-    return hmac.new(secret.encode('utf-8'), canonical.encode('utf-8'), hashlib.sha256).hexdigest()
+def _encode_token(task_token: str) -> str:
+    if _UNRESERVED_CHARS.issuperset(task_token):
+        return task_token
+    return urllib.parse.quote(task_token, safe='')
 
-def create_approval_links(apigw_base: str, task_token: str, execution_id: str) -> Dict[str, str]:
-    encoded_token = urllib.parse.quote(task_token, safe='')
-    timestamp = int(time.time())
-    secret = _get_signing_secret()
-    base = f"{apigw_base}/callback"
+def create_approval_links(apigw_base: str, task_token: str, execution_id: str, now: float) -> Dict[str, str]:
+    encoded_token = _encode_token(task_token)
+    timestamp = int(now)
+    base_mac = _get_hmac_template()
+    prefix = f"{apigw_base}/callback?action="
+    query = f"&token={encoded_token}&executionId={execution_id}&timestamp={timestamp}"
     def build(action: str) -> str:
-        if secret:
-            canonical = _build_canonical_string(task_token, timestamp, action, execution_id)
-            sig = _sign(canonical, secret)
-            return (
-                f"{base}?action={action}&token={encoded_token}&executionId={execution_id}"
-                f"&timestamp={timestamp}&sig={sig}"
-            )
-        else:
-            return f"{base}?action={action}&token={encoded_token}&executionId={execution_id}&timestamp={timestamp}"
+        if base_mac is None:
+            return f"{prefix}{action}{query}"
+        mac = base_mac.copy()
+        mac.update(_build_canonical_string(task_token, timestamp, action, execution_id).encode('utf-8'))
+        return f"{prefix}{action}{query}&sig={mac.hexdigest()}"
     return {'approve_url': build('approve'), 'reject_url': build('reject')}
 
 def format_details_for_notification(details: Dict[str, Any]) -> str:
@@ -138,16 +220,22 @@ def format_details_for_notification(details: Dict[str, Any]) -> str:
     if 'accountWaves' in details:
         account_waves = details['accountWaves']
         if isinstance(account_waves, list) and len(account_waves) > 0:
-            total_accounts = sum(len(wave.get('accounts', [])) for wave in account_waves)
-            total_regions = len(set(region for wave in account_waves for region in wave.get('regions', [])))
-            formatted_parts.append(f"Execution Scope:")
-            formatted_parts.append(f"   • Accounts: {total_accounts}")
-            formatted_parts.append(f"   • Regions: {total_regions}")
-            formatted_parts.append(f"   • Waves: {len(account_waves)}")
+            total_accounts = 0
+            all_regions = set()
+            wave_lines = []
             for i, wave in enumerate(account_waves, 1):
                 accounts = wave.get('accounts', [])
                 regions = wave.get('regions', [])
-                formatted_parts.append(f"   • Wave {i}: {len(accounts)} accounts across {regions}")
+                total_accounts += len(accounts)
+                all_regions.update(regions)
+                wave_lines.append(f"   • Wave {i}: {len(accounts)} accounts across {regions}")
+            formatted_parts.extend((
+                "Execution Scope:",
+                f"   • Accounts: {total_accounts}",
+                f"   • Regions: {len(all_regions)}",
+                f"   • Waves: {len(account_waves)}",
+            ))
+            formatted_parts.extend(wave_lines)
     if 'ec2' in details:
         ec2_config = details['ec2']
         if isinstance(ec2_config, dict):
@@ -162,93 +250,88 @@ def format_details_for_notification(details: Dict[str, Any]) -> str:
         formatted_parts.append(f"Wave Pause: {pause_minutes} minutes")
     return "\n".join(formatted_parts) if formatted_parts else json.dumps(details, indent=2, default=str)
 
-def create_notification_message(subject: str, details: Dict[str, Any], approve_url: str, reject_url: str, execution_id: str, estimated_duration: Any, task_token_hash: str) -> Dict[str, str]:
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
+def create_notification_message(subject: str, details: Dict[str, Any], approve_url: str, reject_url: str, execution_id: str, estimated_duration: Any, task_token_hash: str, now: float) -> Dict[str, str]:
     duration_text = f"{estimated_duration} minutes" if isinstance(estimated_duration, (int, float)) else str(estimated_duration)
-    message_body = f"""
-APPROVAL REQUIRED: EC2 Patching Operation
-
-Execution Information:
-• Execution ID: {execution_id}
-• Request Time: {current_time}
-• Estimated Duration: {duration_text}
-• Request ID: {task_token_hash}
-
-Operation Details:
-{format_details_for_notification(details)}
-
-ACTIONS REQUIRED:
-APPROVE: {approve_url}
-REJECT:  {reject_url}
-
-Notes:
-• Approval will expire after 1 hour
-• All operations are logged and audited
-"""
-    return {'subject': subject, 'body': message_body.strip()}
+    message_body = _MESSAGE_TEMPLATE.format_map({
+        'execution_id': execution_id,
+        'current_time': time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(now)),
+        'duration_text': duration_text,
+        'task_token_hash': task_token_hash,
+        'details': format_details_for_notification(details),
+        'approve_url': approve_url,
+        'reject_url': reject_url,
+    })
+    return {'subject': subject, 'body': message_body}
 
 @retry_with_backoff(max_retries=3, base_delay=1.0)
-def send_sns_notification(topic_arn: str, subject: str, message: str, execution_id: str) -> str:
-    sns_client = boto3.client('sns')
-    logger.info(f"Sending SNS notification for execution {execution_id}")
+def send_sns_notification(topic_arn: str, subject: str, message: str, execution_id: str, now: float) -> str:
+    logger.info("Sending SNS notification for execution %s", execution_id)
     message_attributes = {
         'NotificationType': {'DataType': 'String', 'StringValue': 'ApprovalRequest'},
         'ExecutionId': {'DataType': 'String', 'StringValue': execution_id},
         'Priority': {'DataType': 'String', 'StringValue': 'High'},
-        'Timestamp': {'DataType': 'Number', 'StringValue': str(int(time.time()))}
+        'Timestamp': {'DataType': 'Number', 'StringValue': str(int(now))}
     }
-    response = sns_client.publish(TopicArn=topic_arn, Subject=subject, Message=message, MessageAttributes=message_attributes)
+    response = _SNS.publish(TopicArn=topic_arn, Subject=subject, Message=message, MessageAttributes=message_attributes)
     message_id = response.get('MessageId', 'unknown')
-    logger.info(f"SNS notification sent successfully: {message_id}")
+    logger.info("SNS notification sent successfully: %s", message_id)
     return message_id
 
 def send_slack_notification(webhook_url: str, message_data: Dict[str, str], execution_id: str) -> bool:
     if not webhook_url:
         return False
     try:
+        body = message_data['body']
         payload = {
             "text": "EC2 Patching Approval Required",
             "attachments": [
                 {
                     "color": "warning",
                     "title": message_data['subject'],
-                    "text": message_data['body'][:1000] + "..." if len(message_data['body']) > 1000 else message_data['body'],
+                    "text": body if len(body) <= 1000 else body[:1000] + "...",
                     "footer": f"Execution ID: {execution_id}",
                 }
             ]
         }
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(webhook_url, data=data, headers={'Content-Type': 'application/json'})
-        with urllib.request.urlopen(req, timeout=10) as resp:  # nosec B310
-            if 200 <= resp.getcode() < 300:
-                logger.info(f"Slack notification sent for execution {execution_id}")
-                return True
-            logger.warning(f"Slack webhook returned status: {resp.getcode()}")
-            return False
+        data = _dumps(payload)
+        headers = {'Content-Type': 'application/json'}
+        if _HTTP is not None:
+            status = _HTTP.request('POST', webhook_url, body=data, headers=headers).status
+        else:
+            req = urllib.request.Request(webhook_url, data=data, headers=headers)
+            with urllib.request.urlopen(req, timeout=10) as resp:  # nosec B310
+                status = resp.getcode()
+        if 200 <= status < 300:
+            logger.info("Slack notification sent for execution %s", execution_id)
+            return True
+        logger.warning("Slack webhook returned status: %s", status)
+        return False
     except Exception as e:
-        logger.warning(f"Failed to send Slack notification: {str(e)}")
+        logger.warning("Failed to send Slack notification: %s", e)
         return False
 
 @with_correlation_id
 def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
-    start_time = time.time()
+    now = time.time()
+    start = time.monotonic()
     try:
-        logger.info(f"Processing approval request with event keys: {list(event.keys())}")
-        v = validate_input(event)
-        task_token = v['task_token']
-        subject = v['subject']
-        details = v['details']
-        topic_arn = v['topic_arn']
-        apigw_base = v['apigw_base']
-        execution_id = v['execution_id']
-        estimated_duration = v['estimated_duration']
-        task_token_hash = hashlib.md5(task_token.encode()).hexdigest()[:8]
-        links = create_approval_links(apigw_base, task_token, execution_id)
-        notification = create_notification_message(subject, details, links['approve_url'], links['reject_url'], execution_id, estimated_duration, task_token_hash)
-        message_id = send_sns_notification(topic_arn, notification['subject'], notification['body'], execution_id)
-        slack_webhook = os.environ.get('SLACK_WEBHOOK_URL', '')
-        slack_sent = send_slack_notification(slack_webhook, notification, execution_id) if slack_webhook else False
-        execution_time = time.time() - start_time
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Processing approval request with event keys: %s", list(event))
+        task_token, subject, details, topic_arn, apigw_base, execution_id, estimated_duration = validate_input(event)
+        # 8-hex-char, non-cryptographic fingerprint correlating the request with its audit trail
+        task_token_hash = hashlib.blake2b(task_token.encode(), digest_size=4).hexdigest()
+        links = create_approval_links(apigw_base, task_token, execution_id, now)
+        notification = create_notification_message(subject, details, links['approve_url'], links['reject_url'], execution_id, estimated_duration, task_token_hash, now)
+        if SLACK_WEBHOOK_URL:
+            # Slack delivery overlaps the SNS publish; it never raises, so SNS errors still surface here
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                slack_future = executor.submit(copy_context().run, send_slack_notification, SLACK_WEBHOOK_URL, notification, execution_id)
+                message_id = send_sns_notification(topic_arn, notification['subject'], notification['body'], execution_id, now)
+                slack_sent = slack_future.result()
+        else:
+            message_id = send_sns_notification(topic_arn, notification['subject'], notification['body'], execution_id, now)
+            slack_sent = False
+        execution_time = time.monotonic() - start
         return {
             'statusCode': 200,
             'success': True,
@@ -259,11 +342,11 @@ def handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'notification_channels': {'sns': True, 'slack': slack_sent},
             'approval_links': {'approve_url_length': len(links['approve_url']), 'reject_url_length': len(links['reject_url'])},
             'execution_time_ms': execution_time * 1000,
-            'timestamp': time.time()
+            'timestamp': now
         }
     except ApprovalRequestError as e:
-        logger.error(f"Approval request error: {str(e)}")
+        logger.error("Approval request error: %s", e)
         return {'statusCode': 400, 'success': False, 'notified': False, 'error': str(e), 'error_type': 'ApprovalRequestError'}
     except Exception as e:
-        logger.error(f"Unexpected error in approval request handler: {str(e)}")
+        logger.error("Unexpected error in approval request handler: %s", e)
         return {'statusCode': 500, 'success': False, 'notified': False, 'error': f"Unexpected error: {str(e)}", 'error_type': 'UnexpectedError'}
@@ -2,52 +2,91 @@ import os
 import json
 import time
 import logging
-from typing import Any, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
 
 import boto3
 from botocore.config import Config
-from botocore.exceptions import ClientError
+
+# orjson is optional; it is not part of the Lambda artifact unless vendored into it
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str)
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=str).encode("utf-8")
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Short connect/read timeouts and kept-alive connections for hub-to-spoke calls.
+# Throttling and transient faults are retried by botocore's adaptive mode.
+_STS_CFG = Config(
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+_SSM_CFG = Config(
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={"max_attempts": 10, "mode": "adaptive"},
+)
+
 _session = boto3.session.Session()
-_sts = _session.client("sts")
-
-# Simple retry wrapper for throttling and transient faults
-def _retry(max_attempts=3, base=1.0, factor=2.0):
-    def deco(fn):
-        def wrapper(*args, **kwargs):
-            attempt = 0
-            delay = base
-            while True:
-                try:
-                    return fn(*args, **kwargs)
-                except ClientError as e:
-                    code = e.response.get("Error", {}).get("Code", "")
-                    if code in {"ThrottlingException", "Throttling", "RequestLimitExceeded", "TooManyRequestsException", "InternalError", "ServiceUnavailable"} and attempt < max_attempts - 1:
-                        logger.warning("%s on attempt %s, retrying in %.1fs", code, attempt + 1, delay)
-                        time.sleep(delay)
-                        attempt += 1
-                        delay *= factor
-                        continue
-                    raise
-        return wrapper
-    return deco
-
-@_retry(max_attempts=3, base=1.0, factor=2.0)
+_sts = _session.client("sts", config=_STS_CFG)
+# boto3 sessions are not thread-safe for client creation (batch fan-out)
+_SESSION_LOCK = threading.Lock()
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "32"))
+
+# Assumed-role credentials keyed by (role_arn, external_id) with their expiry
+# epoch; reused until CREDENTIAL_REFRESH_MARGIN seconds before they lapse.
+CREDENTIAL_REFRESH_MARGIN = 300
+_CREDS_CACHE: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+_CREDS_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_CREDS_LOCKS_GUARD = threading.Lock()
+
 def _assume(role_arn: str, external_id: str) -> Dict[str, Any]:
-    params = {
-        "RoleArn": role_arn,
-        "RoleSessionName": "ec2-patch-send-ssm",
-        "DurationSeconds": 3600,
-    }
-    if external_id:
-        params["ExternalId"] = external_id
-    resp = _sts.assume_role(**params)
-    return resp["Credentials"]
+    cache_key = (role_arn, external_id)
+    with _CREDS_LOCKS_GUARD:
+        lock = _CREDS_LOCKS.setdefault(cache_key, threading.Lock())
+
+    # Per-key lock: batch items for one role in several regions wait for a single AssumeRole call
+    with lock:
+        cached = _CREDS_CACHE.get(cache_key)
+        if cached and cached[1] - time.time() > CREDENTIAL_REFRESH_MARGIN:
+            return cached[0]
+        params = {
+            "RoleArn": role_arn,
+            "RoleSessionName": "ec2-patch-send-ssm",
+            "DurationSeconds": 3600,
+        }
+        if external_id:
+            params["ExternalId"] = external_id
+        creds = _sts.assume_role(**params)["Credentials"]
+        _CREDS_CACHE[cache_key] = (creds, creds["Expiration"].timestamp())
+        return creds
+
+# Spoke SSM clients are reused across warm invocations. Credentials are part of
+# the cache key, so refreshed role sessions get a fresh client.
+@lru_cache(maxsize=32)
+def _ssm_client(region: str, access_key_id: str, secret_access_key: str, session_token: str):
+    with _SESSION_LOCK:
+        return _session.client(
+            "ssm",
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            aws_session_token=session_token,
+            config=_SSM_CFG,
+        )
+
 
-@_retry(max_attempts=3, base=1.0, factor=2.0)
 def _send_command(
     ssm,
     document_name: str,
@@ -58,40 +97,21 @@ def _send_command(
     output_s3_bucket: Optional[str] = None,
     output_s3_prefix: Optional[str] = None,
 ) -> Dict[str, Any]:
-    kwargs: Dict[str, Any] = {
-        "DocumentName": document_name,
-        "Targets": targets,
-        "MaxConcurrency": max_concurrency,
-        "MaxErrors": max_errors,
-    }
-    if parameters:
-        kwargs["Parameters"] = parameters
-    if output_s3_bucket:
-        kwargs["OutputS3BucketName"] = output_s3_bucket
-    if output_s3_prefix:
-        kwargs["OutputS3KeyPrefix"] = output_s3_prefix
-    return ssm.send_command(**kwargs)
+    optional = (
+        ("Parameters", parameters),
+        ("OutputS3BucketName", output_s3_bucket),
+        ("OutputS3KeyPrefix", output_s3_prefix),
+    )
+    return ssm.send_command(
+        DocumentName=document_name,
+        Targets=targets,
+        MaxConcurrency=max_concurrency,
+        MaxErrors=max_errors,
+        **{key: value for key, value in optional if value},
+    )
 
 
-def handler(event, context):
-    """
-    Input contract:
-    {
-      "roleArn": "arn:aws:iam::<spoke>:role/<PatchExecRole>",
-      "externalId": "<external-id>",
-      "region": "us-east-1",
-      "documentName": "AWS-RunPatchBaseline",
-      "targets": [{"Key": "tag:PatchGroup", "Values": ["prod"]}],
-      "maxConcurrency": "10%",
-      "maxErrors": "1",
-      "parameters": { ... optional SSM doc params ... }
-    }
-
-    Output:
-    { "CommandId": "<id>", "Region": "<region>", "Account": "<derived from role arn>" }
-    """
-    logger.info("Event: %s", json.dumps(event))
-
+def _process_one(event: Dict[str, Any]) -> Dict[str, Any]:
     role_arn = event.get("roleArn")
     external_id = event.get("externalId", "")
     region = event.get("region")
@@ -102,19 +122,15 @@ def handler(event, context):
     parameters = event.get("parameters")
     output_s3_bucket = event.get("outputS3Bucket")
     output_s3_prefix = event.get("outputS3Prefix")
+    logger.info("SendCommand request: roleArn=%s region=%s documentName=%s", role_arn, region, document_name)
 
     if not role_arn or not region:
         raise ValueError("roleArn and region are required")
+    if not targets:
+        raise ValueError("targets must contain at least one target")
 
     creds = _assume(role_arn, external_id)
-    ssm = _session.client(
-        "ssm",
-        region_name=region,
-        aws_access_key_id=creds["AccessKeyId"],
-        aws_secret_access_key=creds["SecretAccessKey"],
-        aws_session_token=creds["SessionToken"],
-        config=Config(retries={"max_attempts": 10, "mode": "standard"}),
-    )
+    ssm = _ssm_client(region, creds["AccessKeyId"], creds["SecretAccessKey"], creds["SessionToken"])
 
     resp = _send_command(
         ssm,
@@ -128,5 +144,50 @@ def handler(event, context):
     )
 
     cmd_id = resp.get("Command", {}).get("CommandId")
-    account_id = role_arn.split(":")[4]
+    account_id = role_arn.split(":", 5)[4]
     return {"CommandId": cmd_id, "Region": region, "Account": account_id}
+
+
+def _process_batch_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    # Commands already sent for other items must still be reported, so a failed
+    # item is returned as an error entry rather than failing the whole batch.
+    try:
+        return _process_one(item)
+    except Exception as e:
+        logger.error("SendCommand failed for %s in %s: %s", item.get("roleArn"), item.get("region"), e)
+        return {"Error": str(e), "ErrorType": type(e).__name__, "Region": item.get("region"), "RoleArn": item.get("roleArn")}
+
+
+def handler(event, context):
+    """
+    Input contract:
+    {
+      "roleArn": "arn:aws:iam::<spoke>:role/<PatchExecRole>",
+      "externalId": "<external-id>",
+      "region": "us-east-1",
+      "documentName": "AWS-RunPatchBaseline",
+      "targets": [{"Key": "tag:PatchGroup", "Values": ["prod"]}],
+      "maxConcurrency": "10%",
+      "maxErrors": "1",
+      "parameters": { ... optional SSM doc params ... }
+    }
+    or { "batch": [ <single-item inputs as above> ] }
+
+    Output:
+    { "CommandId": "<id>", "Region": "<region>", "Account": "<derived from role arn>" }
+    or, for batch input, { "Results": [ <per-item output, or Error/ErrorType/Region/RoleArn> ] }
+    in input order.
+    """
+    # Serializing the whole event is only worth it when debugging.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", _dumps(event).decode("utf-8"))
+
+    batch = event.get("batch")
+    if batch is None:
+        return _process_one(event)
+    if not isinstance(batch, list) or not all(isinstance(item, dict) for item in batch):
+        raise ValueError("batch must be a list of request objects")
+    if not batch:
+        return {"Results": []}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(batch))) as executor:
+        return {"Results": list(executor.map(_process_batch_item, batch))}
@@ -238,6 +238,671 @@ class TestLambdaFunctions(unittest.TestCase):
             self.assertEqual(result['results']['summary']['failed'], 1)
 
 
+class TestApprovalAuthorizer(unittest.TestCase):
+    """Unit tests for the approval callback authorizer"""
+
+    SECRET = b'test-signing-secret'
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import ApprovalAuthorizer
+        self.authorizer = ApprovalAuthorizer
+        for name, value in (('_cached_secret_value', self.SECRET), ('_hmac_template', None)):
+            patcher = patch.object(ApprovalAuthorizer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _event(self, action='approve', timestamp=None, sig=None):
+        import hmac
+        import hashlib
+        ts = str(int(time.time()) if timestamp is None else timestamp)
+        canonical = f"task-token:{ts}:{action}:exec-1".encode('utf-8')
+        if sig is None:
+            sig = hmac.new(self.SECRET, canonical, hashlib.sha256).hexdigest()
+        return {'queryStringParameters': {
+            'sig': sig, 'token': 'task-token', 'timestamp': ts, 'action': action, 'executionId': 'exec-1'
+        }}
+
+    def test_valid_signature_is_authorized(self):
+        result = self.authorizer.handler(self._event(), DummyContext())
+        self.assertTrue(result['isAuthorized'])
+        self.assertEqual(result['context'], {'action': 'approve', 'executionId': 'exec-1'})
+
+    def test_tampered_signature_is_rejected(self):
+        event = self._event()
+        event['queryStringParameters']['action'] = 'reject'
+        self.assertFalse(self.authorizer.handler(event, DummyContext())['isAuthorized'])
+
+    def test_expired_timestamp_is_rejected(self):
+        event = self._event(timestamp=int(time.time()) - 2 * 3600)
+        self.assertFalse(self.authorizer.handler(event, DummyContext())['isAuthorized'])
+
+    def test_non_numeric_timestamp_is_rejected(self):
+        for ts in ['abc', '-1', '1e9', '12345678901', '\u00b2']:
+            event = self._event()
+            event['queryStringParameters']['timestamp'] = ts
+            self.assertFalse(self.authorizer.handler(event, DummyContext())['isAuthorized'])
+
+    def test_non_ascii_execution_id_verifies(self):
+        import hmac
+        import hashlib
+        ts = str(int(time.time()))
+        execution_id = 'ex\u00e9c-1'
+        canonical = f"task-token:{ts}:approve:{execution_id}".encode('utf-8')
+        event = {'queryStringParameters': {
+            'sig': hmac.new(self.SECRET, canonical, hashlib.sha256).hexdigest(),
+            'token': 'task-token', 'timestamp': ts, 'action': 'approve', 'executionId': execution_id,
+        }}
+        self.assertTrue(self.authorizer.handler(event, DummyContext())['isAuthorized'])
+
+    def test_malformed_signature_skips_secret_lookup(self):
+        with patch.object(self.authorizer, '_get_hmac_template') as mock_secret:
+            for sig in ['abc', 'Z' * 64, 'a' * 10000]:
+                result = self.authorizer.handler(self._event(sig=sig), DummyContext())
+                self.assertFalse(result['isAuthorized'])
+            mock_secret.assert_not_called()
+
+
+class TestApprovalCallback(unittest.TestCase):
+    """Unit tests for the approval callback handler"""
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import ApprovalCallback
+        self.callback = ApprovalCallback
+        self.mock_sfn = Mock()
+        self.mock_sns = Mock()
+        self.mock_table = Mock()
+        for name, value in (('sfn_client', self.mock_sfn), ('sns_client', self.mock_sns), ('audit_table', self.mock_table)):
+            patcher = patch.object(ApprovalCallback, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _event(self, action):
+        return {
+            'queryStringParameters': {
+                'action': action, 'token': 'task-token', 'executionId': 'exec-1',
+                'timestamp': str(int(time.time()))
+            },
+            'requestContext': {'identity': {'sourceIp': '10.0.0.1'}},
+            'headers': {'User-Agent': 'pytest'}
+        }
+
+    def test_approve_sends_task_success(self):
+        result = self.callback.handler(self._event('approve'), DummyContext())
+        self.assertEqual(result['statusCode'], 200)
+        self.assertIn('Approved Successfully', result['body'])
+        self.mock_sfn.send_task_success.assert_called_once()
+        self.assertEqual(self.mock_sfn.send_task_success.call_args.kwargs['taskToken'], 'task-token')
+        self.mock_table.put_item.assert_called_once()
+
+    def test_reject_sends_task_failure(self):
+        result = self.callback.handler(self._event('reject'), DummyContext())
+        self.assertEqual(result['statusCode'], 200)
+        self.assertIn('Rejected Successfully', result['body'])
+        self.mock_sfn.send_task_failure.assert_called_once()
+        self.assertEqual(self.mock_sfn.send_task_failure.call_args.kwargs['error'], 'ManualRejection')
+
+    def test_retry_backs_off_on_throttling_only(self):
+        from botocore.exceptions import ClientError
+
+        def client_error(code, status):
+            return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'SendTaskSuccess')
+
+        calls = Mock(side_effect=[client_error('ThrottlingException', 400), 'ok'], __name__='send')
+        retried = self.callback.retry_with_backoff(max_retries=3, base_delay=1.0)(calls)
+        with patch.object(self.callback.time, 'sleep') as mock_sleep:
+            self.assertEqual(retried(), 'ok')
+        self.assertEqual(calls.call_count, 2)
+        self.assertLessEqual(mock_sleep.call_args.args[0], 1.0)
+
+        calls = Mock(side_effect=client_error('AccessDeniedException', 400), __name__='send')
+        denied = self.callback.retry_with_backoff(max_retries=3)(calls)
+        with patch.object(self.callback.time, 'sleep') as mock_sleep:
+            with self.assertRaises(ClientError):
+                denied()
+        self.assertEqual(calls.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_notification_published_when_topic_configured(self):
+        with patch.object(self.callback, 'NOTIFICATION_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:topic'):
+            self.callback.handler(self._event('approve'), DummyContext())
+        kwargs = self.mock_sns.publish.call_args.kwargs
+        self.assertEqual(kwargs['Subject'], 'EC2 Patching Approved - exec-1')
+        self.assertTrue(kwargs['Message'].startswith('Approval Decision Processed successfully\n\nExecution ID: exec-1'))
+        self.assertEqual(kwargs['MessageAttributes']['NotificationType']['StringValue'], 'ApprovalDecision')
+
+    def test_success_page_is_gzipped_when_accepted(self):
+        import base64
+        import gzip
+        event = self._event('approve')
+        event['headers']['accept-encoding'] = 'gzip, deflate'
+        result = self.callback.handler(event, DummyContext())
+        self.assertEqual(result['statusCode'], 200)
+        self.assertTrue(result['isBase64Encoded'])
+        self.assertEqual(result['headers']['Content-Encoding'], 'gzip')
+        body = gzip.decompress(base64.b64decode(result['body'])).decode('utf-8')
+        self.assertIn('Approved Successfully', body)
+        self.assertNotIn('\n', body)
+        self.assertRegex(body, r'Processed at: \d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC<')
+        self.assertNotIn('<script>', body)
+
+    def test_expired_request_returns_400(self):
+        event = self._event('approve')
+        event['queryStringParameters']['timestamp'] = str(int(time.time()) - self.callback.APPROVAL_EXPIRY_SECONDS - 5)
+        result = self.callback.handler(event, DummyContext())
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('expired', result['body'])
+        self.mock_sfn.send_task_success.assert_not_called()
+
+    def test_retry_waits_when_send_budget_is_exhausted(self):
+        calls = Mock(return_value='ok', __name__='send')
+        retried = self.callback.retry_with_backoff(max_retries=3)(calls)
+        bucket = {'tokens': -1.0, 'last': time.monotonic()}
+        with patch.object(self.callback, '_bucket', bucket), patch.object(self.callback.time, 'sleep') as mock_sleep:
+            self.assertEqual(retried(), 'ok')
+        self.assertGreater(mock_sleep.call_args.args[0], 0.0)
+        self.assertLess(bucket['tokens'], 0.0)
+
+    def test_invalid_action_returns_400(self):
+        result = self.callback.handler(self._event('delete'), DummyContext())
+        self.assertEqual(result['statusCode'], 400)
+        self.mock_sfn.send_task_success.assert_not_called()
+        self.mock_sfn.send_task_failure.assert_not_called()
+
+
+class TestAuditBatchWriter(unittest.TestCase):
+    """Unit tests for the SQS -> DynamoDB audit batch writer"""
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import AuditBatchWriter
+        self.writer = AuditBatchWriter
+        self.mock_ddb = Mock()
+        for patcher in (patch.object(AuditBatchWriter, 'dynamodb', self.mock_ddb), patch.object(AuditBatchWriter.time, 'sleep')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _records(self, count):
+        return [{'messageId': f'm{i}', 'body': json.dumps({'audit_id': f'a{i}', 'action': 'approve'})} for i in range(count)]
+
+    @patch.dict('os.environ', {'AUDIT_TABLE': 'audit'})
+    def test_writes_in_batches_of_25(self):
+        self.mock_ddb.batch_write_item.return_value = {'UnprocessedItems': {}}
+        result = self.writer.handler({'Records': self._records(30)}, DummyContext())
+        self.assertEqual(result, {'batchItemFailures': []})
+        sizes = [len(c.kwargs['RequestItems']['audit']) for c in self.mock_ddb.batch_write_item.call_args_list]
+        self.assertEqual(sizes, [25, 5])
+
+    @patch.dict('os.environ', {'AUDIT_TABLE': 'audit'})
+    def test_reports_unprocessed_and_malformed_messages(self):
+        stuck = {'PutRequest': {'Item': {'audit_id': 'a1', 'action': 'approve'}}}
+        self.mock_ddb.batch_write_item.return_value = {'UnprocessedItems': {'audit': [stuck]}}
+        records = self._records(2) + [{'messageId': 'bad', 'body': 'not json'}]
+        result = self.writer.handler({'Records': records}, DummyContext())
+        failed = {f['itemIdentifier'] for f in result['batchItemFailures']}
+        self.assertEqual(failed, {'m1', 'bad'})
+        self.assertEqual(self.mock_ddb.batch_write_item.call_count, self.writer.MAX_ATTEMPTS)
+
+    @patch.dict('os.environ', {'AUDIT_TABLE': 'audit'})
+    def test_duplicate_messages_share_one_write(self):
+        self.mock_ddb.batch_write_item.return_value = {'UnprocessedItems': {}}
+        records = self._records(2) + [{'messageId': 'm0-dup', 'body': self._records(1)[0]['body']}]
+        result = self.writer.handler({'Records': records}, DummyContext())
+        self.assertEqual(result, {'batchItemFailures': []})
+        written = [r['PutRequest']['Item']['audit_id'] for r in self.mock_ddb.batch_write_item.call_args.kwargs['RequestItems']['audit']]
+        self.assertEqual(written, ['a0', 'a1'])
+
+    @patch.dict('os.environ', {'AUDIT_TABLE': 'audit'})
+    def test_non_retryable_errors_fail_fast(self):
+        from botocore.exceptions import ClientError
+        self.mock_ddb.batch_write_item.side_effect = ClientError({'Error': {'Code': 'ValidationException'}}, 'BatchWriteItem')
+        records = self._records(2) + [{'messageId': 'm0-dup', 'body': self._records(1)[0]['body']}]
+        result = self.writer.handler({'Records': records}, DummyContext())
+        self.assertEqual({f['itemIdentifier'] for f in result['batchItemFailures']}, {'m0', 'm0-dup', 'm1'})
+        self.assertEqual(self.mock_ddb.batch_write_item.call_count, 1)
+
+
+class TestPostEC2Verify(unittest.TestCase):
+    """Unit tests for the post-patching verification handler"""
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import PostEC2Verify
+        self.verify = PostEC2Verify
+        self._patch('S3_BUCKET', new='test-patching-bucket')
+        self._patch('DDB_TABLE', new='test-patch-runs')
+
+    def _patch(self, name, **kwargs):
+        patcher = patch.object(self.verify, name, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_fans_out_account_regions_and_aggregates(self):
+        states = {
+            'us-east-1': [{'InstanceId': 'i-1', 'MissingCount': 0, 'FailedCount': 0}],
+            'eu-west-1': [{'InstanceId': 'i-2', 'MissingCount': 0, 'FailedCount': 2}],
+        }
+        self._patch('assume_cross_account_role', return_value={'AccessKeyId': 'k', 'SecretAccessKey': 's', 'SessionToken': 't'})
+        self._patch('get_patch_states', side_effect=lambda credentials, region: states[region])
+        self._patch('store_results_s3', side_effect=lambda bucket, key, body, metadata: f's3://{bucket}/{key}')
+        mock_ddb = self._patch('dynamodb_client')
+        mock_ddb.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        event = {'accounts': ['123456789012', '210987654321'], 'regions': ['us-east-1', 'eu-west-1']}
+        mock_cw = self._patch('cloudwatch_client')
+        result = self.verify.handler(event, DummyContext())
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(result['summary']['total_processes'], 4)
+        self.assertEqual(result['summary']['total_instances'], 4)
+        self.assertEqual(result['summary']['problematic_instances'], 2)
+        self.assertEqual([(r['account'], r['region']) for r in result['results']], [
+            ('123456789012', 'us-east-1'), ('123456789012', 'eu-west-1'),
+            ('210987654321', 'us-east-1'), ('210987654321', 'eu-west-1'),
+        ])
+        mock_ddb.batch_write_item.assert_called_once()
+        items = mock_ddb.batch_write_item.call_args.kwargs['RequestItems']['test-patch-runs']
+        self.assertEqual(len(items), 4)
+        self.assertEqual(items[1]['PutRequest']['Item']['success_rate'], {'N': '0.0'})
+        self.assertNotIn('ddb_record', result['results'][0])
+        mock_cw.put_metric_data.assert_called_once()
+        self.assertEqual(len(mock_cw.put_metric_data.call_args.kwargs['MetricData']), 12)
+        self.assertNotIn('metrics', result['results'][0])
+
+    def test_assumed_role_credentials_are_cached_until_near_expiry(self):
+        self._patch('_CREDS_CACHE', new={})
+        mock_sts = self._patch('sts_client')
+        mock_sts.assume_role.return_value = {'Credentials': {
+            'AccessKeyId': 'k', 'SecretAccessKey': 's', 'SessionToken': 't',
+            'Expiration': datetime.fromtimestamp(time.time() + 3600)
+        }}
+        first = self.verify.assume_cross_account_role('123456789012')
+        second = self.verify.assume_cross_account_role('123456789012')
+        self.assertIs(first, second)
+        mock_sts.assume_role.assert_called_once()
+
+        self.verify._CREDS_CACHE[('123456789012', 'PatchExecRole')] = (first, time.time() + 60)
+        self.verify.assume_cross_account_role('123456789012')
+        self.assertEqual(mock_sts.assume_role.call_count, 2)
+
+    def test_dynamodb_summaries_retry_unprocessed_items(self):
+        records = [{'scope': 'EC2#POST', 'id': f'12345678901{i}:us-east-1:2024/01/01'} for i in range(30)]
+        mock_ddb = self._patch('dynamodb_client')
+        leftover = {'PutRequest': {'Item': {'scope': {'S': 'EC2#POST'}, 'id': {'S': records[0]['id']}}}}
+        mock_ddb.batch_write_item.side_effect = [
+            {'UnprocessedItems': {'test-patch-runs': [leftover]}},
+            {'UnprocessedItems': {}},
+            {'UnprocessedItems': {}},
+        ]
+        with patch.object(self.verify.time, 'sleep'):
+            failed = self.verify.store_results_dynamodb('test-patch-runs', records, 1704067200)
+        self.assertEqual(failed, [])
+        self.assertEqual(mock_ddb.batch_write_item.call_count, 3)
+        first_batch = mock_ddb.batch_write_item.call_args_list[0].kwargs['RequestItems']['test-patch-runs']
+        self.assertEqual(len(first_batch), 25)
+
+    def test_dynamodb_connection_errors_mark_chunk_failed(self):
+        from botocore.exceptions import EndpointConnectionError
+        records = [{'scope': 'EC2#POST', 'id': f'12345678901{i}:us-east-1:2024/01/01'} for i in range(30)]
+        mock_ddb = self._patch('dynamodb_client')
+        mock_ddb.batch_write_item.side_effect = [EndpointConnectionError(endpoint_url='https://dynamodb')] * self.verify.DDB_MAX_ATTEMPTS + [
+            {'UnprocessedItems': {}},
+        ]
+        with patch.object(self.verify.time, 'sleep'):
+            failed = self.verify.store_results_dynamodb('test-patch-runs', records, 1704067200)
+        self.assertEqual(failed, [record['id'] for record in records[:25]])
+        self.assertEqual(mock_ddb.batch_write_item.call_count, self.verify.DDB_MAX_ATTEMPTS + 1)
+
+    def test_patch_states_are_streamed_to_s3_as_gzipped_json_lines(self):
+        import gzip
+        states = [{'InstanceId': 'i-1', 'MissingCount': 0, 'FailedCount': 0}, {'InstanceId': 'i-2', 'MissingCount': 1, 'FailedCount': 0}]
+        self._patch('assume_cross_account_role', return_value={'AccessKeyId': 'k'})
+        self._patch('get_patch_states', return_value=iter(states))
+        mock_s3 = self._patch('s3_client')
+        uploaded = {}
+        mock_s3.upload_fileobj.side_effect = lambda body, bucket, key, ExtraArgs: uploaded.update(body=body.read(), key=key, args=ExtraArgs)
+
+        result = self.verify.process_account_region('123456789012', 'us-east-1', 'test-patching-bucket', 'exec-1', '2024/01/01', 1704067200)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['analysis']['problematic_instances'], 1)
+        self.assertEqual(uploaded['key'], '2024/01/01/123456789012/us-east-1/post_ec2_patchstates.jsonl.gz')
+        self.assertEqual(uploaded['args']['ContentEncoding'], 'gzip')
+        self.assertEqual(uploaded['args']['Metadata']['instance-count'], '2')
+        lines = gzip.decompress(uploaded['body']).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], states)
+
+    def test_analyze_patch_states_counts_severity(self):
+        analysis = self.verify.analyze_patch_states([
+            {'InstanceId': 'i-1', 'MissingCount': 0, 'FailedCount': 0},
+            {'InstanceId': 'i-2', 'MissingCount': 3, 'FailedCount': 0},
+            {'InstanceId': 'i-3', 'MissingCount': 1, 'FailedCount': 1},
+            {'InstanceId': 'i-4'},
+        ])
+        self.assertEqual(analysis['problematic_instances'], 2)
+        self.assertEqual(analysis['healthy_instances'], 2)
+        self.assertEqual(analysis['success_rate'], 50.0)
+        self.assertEqual([i['severity'] for i in analysis['issues_found']], ['medium', 'high'])
+        self.assertEqual(analysis['analysis'], '2/4 instances have issues; 1 with failed patches; 1 with missing patches')
+
+    def test_get_patch_states_batches_instance_ids(self):
+        mock_ssm = Mock()
+        info_paginator, states_paginator = Mock(), Mock()
+        info_paginator.paginate.return_value = [
+            {'InstanceInformationList': [{'InstanceId': f'i-{n}'} for n in range(50)]},
+            {'InstanceInformationList': [{'InstanceId': f'i-{n}'} for n in range(50, 60)]},
+        ]
+        states_paginator.paginate.side_effect = lambda InstanceIds, **_: [{'InstancePatchStates': [
+            {'InstanceId': iid, 'MissingCount': 0, 'FailedCount': 0, 'OwnerInformation': 'x'} for iid in InstanceIds
+        ]}]
+        mock_ssm.get_paginator.side_effect = lambda name: info_paginator if name == 'describe_instance_information' else states_paginator
+        self._patch('_ssm_client', return_value=mock_ssm)
+
+        states = list(self.verify.get_patch_states({'AccessKeyId': 'k'}, 'us-east-1'))
+
+        self.assertEqual(len(states), 60)
+        self.assertEqual([len(c.kwargs['InstanceIds']) for c in states_paginator.paginate.call_args_list], [50, 10])
+        self.assertEqual(info_paginator.paginate.call_args.kwargs['PaginationConfig'], {'PageSize': 50})
+        self.assertNotIn('OwnerInformation', states[0])
+
+    def test_empty_region_skips_s3_and_metrics(self):
+        self._patch('assume_cross_account_role', return_value={'AccessKeyId': 'k'})
+        self._patch('get_patch_states', return_value=iter(()))
+        mock_s3 = self._patch('s3_client')
+        result = self.verify.process_account_region('123456789012', 'us-east-1', 'test-patching-bucket', 'exec-1', '2024/01/01', 1704067200)
+        self.assertTrue(result['success'])
+        self.assertTrue(result['skipped'])
+        self.assertEqual(result['metrics'], [])
+        self.assertEqual(result['ddb_record']['id'], '123456789012:us-east-1:2024/01/01')
+        mock_s3.upload_fileobj.assert_not_called()
+
+    def test_analyze_patch_states_bounds_issue_details(self):
+        self._patch('MAX_ISSUE_DETAILS', new=5)
+        states = ({'InstanceId': f'i-{n}', 'MissingCount': 1, 'FailedCount': n % 2} for n in range(1000))
+        analysis = self.verify.analyze_patch_states(states)
+        self.assertEqual(analysis['problematic_instances'], 1000)
+        self.assertEqual(len(analysis['issues_found']), 5)
+        self.assertEqual(analysis['analysis'], '1000/1000 instances have issues; 500 with failed patches; 500 with missing patches')
+
+    def test_validate_input_rejects_bad_accounts_and_regions(self):
+        for event in ({'accounts': ['12345678901x']}, {'accounts': [123456789012]},
+                      {'accounts': ['123456789012'], 'regions': ['us-east-1', 'not a region']}):
+            with self.assertRaises(self.verify.PostVerificationError):
+                self.verify.validate_input(event, 0)
+        validated = self.verify.validate_input({'accounts': ['123456789012'], 'regions': ['us-gov-west-1', 'ap-southeast-2']}, 0)
+        self.assertEqual(validated['execution_id'], 'exec-0')
+
+    def test_warmup_ping_short_circuits(self):
+        assume = self._patch('assume_cross_account_role')
+        self.assertEqual(self.verify.handler({'warmup': True}, DummyContext()), {'statusCode': 200, 'warm': True})
+        assume.assert_not_called()
+
+    def test_failed_account_region_is_reported_not_raised(self):
+        self._patch('assume_cross_account_role', side_effect=self.verify.PostVerificationError('denied'))
+        result = self.verify.handler({'accounts': ['123456789012'], 'regions': ['us-east-1']}, DummyContext())
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(result['summary']['failed_processes'], 1)
+        self.assertEqual(result['results'][0]['error_type'], 'PostVerificationError')
+
+
+class TestSendApprovalRequest(unittest.TestCase):
+    """Unit tests for the approval request notifier"""
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import SendApprovalRequest
+        self.request = SendApprovalRequest
+        self._patch('_SIGNING_SECRET_CACHE', new={'value': None, 'expires': 0.0})
+        self._patch('_HMAC_TEMPLATE', new={'key': None, 'mac': None})
+
+    def _patch(self, name, **kwargs):
+        patcher = patch.object(self.request, name, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_signing_secret_is_cached_across_calls(self):
+        self._patch('APPROVAL_SIGNING_SECRET_ARN', new='arn:aws:secretsmanager:us-east-1:123456789012:secret:s')
+        mock_sm = self._patch('_SM_CLIENT')
+        mock_sm.get_secret_value.return_value = {'SecretString': '{"secret": "s3cr3t"}'}
+        self.assertEqual(self.request._get_signing_secret(), b's3cr3t')
+        self.assertIs(self.request._get_hmac_template(), self.request._get_hmac_template())
+        mock_sm.get_secret_value.assert_called_once()
+
+    def test_approval_links_carry_independent_signatures(self):
+        import hmac
+        import hashlib
+        from urllib.parse import urlsplit, parse_qs
+        self._patch('_get_signing_secret', return_value=b's3cr3t')
+        links = self.request.create_approval_links('https://api.example.com', 'tok/en+', 'exec-1', time.time())
+        for action in ('approve', 'reject'):
+            query = parse_qs(urlsplit(links[f'{action}_url']).query)
+            self.assertEqual(query['action'], [action])
+            self.assertEqual(query['token'], ['tok/en+'])
+            canonical = f"tok/en+:{query['timestamp'][0]}:{action}:exec-1".encode('utf-8')
+            self.assertEqual(query['sig'], [hmac.new(b's3cr3t', canonical, hashlib.sha256).hexdigest()])
+
+    def test_notification_message_uses_utc_time(self):
+        message = self.request.create_notification_message(
+            'Subject', {'custom': '{braces}'}, 'https://a', 'https://r', 'exec-1', 30, 'abcd1234', 0)
+        body = message['body']
+        self.assertTrue(body.startswith('APPROVAL REQUIRED'))
+        self.assertIn('Request Time: 1970-01-01 00:00:00 UTC', body)
+        self.assertIn('Estimated Duration: 30 minutes', body)
+        self.assertIn('{braces}', body)
+        self.assertTrue(body.endswith('All operations are logged and audited'))
+
+    def test_format_details_summarizes_waves(self):
+        text = self.request.format_details_for_notification({'accountWaves': [
+            {'accounts': ['111111111111', '222222222222'], 'regions': ['us-east-1', 'eu-west-1']},
+            {'accounts': ['333333333333'], 'regions': ['us-east-1']},
+        ]})
+        self.assertEqual(text.splitlines(), [
+            'Execution Scope:',
+            '   • Accounts: 3',
+            '   • Regions: 2',
+            '   • Waves: 2',
+            "   • Wave 1: 2 accounts across ['us-east-1', 'eu-west-1']",
+            "   • Wave 2: 1 accounts across ['us-east-1']",
+        ])
+
+    def test_handler_notifies_sns_and_slack(self):
+        self._patch('TOPIC_ARN', new='arn:aws:sns:us-east-1:123456789012:approvals')
+        self._patch('APIGW_BASE', new='https://api.example.com')
+        self._patch('SLACK_WEBHOOK_URL', new='https://hooks.example.com/x')
+        self._patch('_get_signing_secret', return_value=None)
+        mock_sns = self._patch('_SNS')
+        mock_sns.publish.return_value = {'MessageId': 'msg-1'}
+        mock_slack = self._patch('send_slack_notification', return_value=True)
+
+        result = self.request.handler({'taskToken': 'token', 'executionId': 'exec-1'}, DummyContext())
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(result['message_id'], 'msg-1')
+        self.assertEqual(result['notification_channels'], {'sns': True, 'slack': True})
+        mock_slack.assert_called_once()
+
+    def test_handler_rejects_missing_configuration(self):
+        self._patch('TOPIC_ARN', new=None)
+        result = self.request.handler({'taskToken': 'token'}, DummyContext())
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('TOPIC_ARN', result['error'])
+
+    def test_slack_notification_uses_pooled_connection(self):
+        mock_http = self._patch('_HTTP')
+        mock_http.request.return_value.status = 200
+        message = {'subject': 'Approve', 'body': 'x' * 1500}
+
+        self.assertTrue(self.request.send_slack_notification('https://hooks.example.com/x', message, 'exec-1'))
+        method, url = mock_http.request.call_args[0]
+        payload = json.loads(mock_http.request.call_args[1]['body'])
+        self.assertEqual((method, url), ('POST', 'https://hooks.example.com/x'))
+        self.assertEqual(len(payload['attachments'][0]['text']), 1003)
+
+        mock_http.request.return_value.status = 500
+        self.assertFalse(self.request.send_slack_notification('https://hooks.example.com/x', message, 'exec-1'))
+
+    def test_retry_uses_jittered_backoff(self):
+        from botocore.exceptions import ClientError
+        throttled = ClientError({'Error': {'Code': 'Throttling'}}, 'Publish')
+        calls = Mock(side_effect=[throttled, throttled, 'ok'], __name__='publish')
+        with patch.object(self.request.time, 'sleep') as mock_sleep, \
+                patch.object(self.request.random, 'uniform', side_effect=lambda lo, hi: hi / 2) as mock_uniform:
+            self.assertEqual(self.request.retry_with_backoff(max_retries=3, base_delay=1.0)(calls)(), 'ok')
+        self.assertEqual([c.args for c in mock_uniform.call_args_list], [(0, 1.0), (0, 2.0)])
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [0.5, 1.0])
+
+        func = Mock()
+        self.assertIs(self.request.retry_with_backoff(max_retries=1)(func), func)
+
+    def test_encode_token_matches_quote(self):
+        from urllib.parse import quote
+        for token in ('AAAAKgAAAAIAAAAA-_.~', 'abc+/=', 'caf\u00e9', ''):
+            self.assertEqual(self.request._encode_token(token), quote(token, safe=''))
+
+
+class TestSendSsmCommand(unittest.TestCase):
+    """Unit tests for the SSM command dispatcher"""
+
+    CREDS = {'AccessKeyId': 'k', 'SecretAccessKey': 's', 'SessionToken': 't'}
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import SendSsmCommand
+        self.send = SendSsmCommand
+        self.send._ssm_client.cache_clear()
+        self.addCleanup(self.send._ssm_client.cache_clear)
+        self._patch('_CREDS_CACHE', new={})
+
+    def _patch(self, name, **kwargs):
+        patcher = patch.object(self.send, name, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_reuses_ssm_client_for_same_credentials(self):
+        self._patch('_assume', return_value=self.CREDS)
+        mock_session = self._patch('_session')
+        mock_session.client.return_value.send_command.return_value = {'Command': {'CommandId': 'cmd-1'}}
+        event = {'roleArn': 'arn:aws:iam::123456789012:role/PatchExecRole', 'region': 'us-east-1',
+                 'targets': [{'Key': 'tag:PatchGroup', 'Values': ['prod']}]}
+
+        for _ in range(2):
+            result = self.send.handler(event, DummyContext())
+
+        self.assertEqual(result, {'CommandId': 'cmd-1', 'Region': 'us-east-1', 'Account': '123456789012'})
+        mock_session.client.assert_called_once()
+        mock_session.client.return_value.send_command.assert_called_with(
+            DocumentName='AWS-RunPatchBaseline', Targets=event['targets'], MaxConcurrency='10%', MaxErrors='1')
+
+    def test_logs_request_summary_at_info(self):
+        self._patch('_assume', return_value=self.CREDS)
+        mock_session = self._patch('_session')
+        mock_session.client.return_value.send_command.return_value = {'Command': {'CommandId': 'cmd-1'}}
+        event = {'roleArn': 'arn:aws:iam::123456789012:role/PatchExecRole', 'region': 'eu-west-1',
+                 'targets': [{'Key': 'tag:PatchGroup', 'Values': ['prod']}]}
+        with self.assertLogs(self.send.logger, level='INFO') as logs:
+            self.send.handler(event, DummyContext())
+        self.assertIn('roleArn=arn:aws:iam::123456789012:role/PatchExecRole region=eu-west-1 documentName=AWS-RunPatchBaseline',
+                      '\n'.join(logs.output))
+
+    def test_batch_input_fans_out_and_reports_failures(self):
+        self._patch('_assume', return_value=self.CREDS)
+        mock_session = self._patch('_session')
+        mock_session.client.return_value.send_command.return_value = {'Command': {'CommandId': 'cmd-1'}}
+        targets = [{'Key': 'tag:PatchGroup', 'Values': ['prod']}]
+        batch = [
+            {'roleArn': 'arn:aws:iam::111111111111:role/PatchExecRole', 'region': 'us-east-1', 'targets': targets},
+            {'roleArn': 'arn:aws:iam::222222222222:role/PatchExecRole', 'region': 'eu-west-1'},
+            {'roleArn': 'arn:aws:iam::333333333333:role/PatchExecRole', 'region': 'us-west-2', 'targets': targets},
+        ]
+
+        results = self.send.handler({'batch': batch}, DummyContext())['Results']
+
+        self.assertEqual(results[0], {'CommandId': 'cmd-1', 'Region': 'us-east-1', 'Account': '111111111111'})
+        self.assertEqual(results[1]['ErrorType'], 'ValueError')
+        self.assertEqual(results[1]['Region'], 'eu-west-1')
+        self.assertEqual(results[2], {'CommandId': 'cmd-1', 'Region': 'us-west-2', 'Account': '333333333333'})
+
+    def test_batch_for_one_role_assumes_it_once(self):
+        def slow_assume_role(**kwargs):
+            time.sleep(0.05)
+            return {'Credentials': dict(self.CREDS, Expiration=datetime.fromtimestamp(time.time() + 3600))}
+        mock_sts = self._patch('_sts')
+        mock_sts.assume_role.side_effect = slow_assume_role
+        mock_session = self._patch('_session')
+        mock_session.client.return_value.send_command.return_value = {'Command': {'CommandId': 'cmd-1'}}
+        targets = [{'Key': 'tag:PatchGroup', 'Values': ['prod']}]
+        batch = [{'roleArn': 'arn:aws:iam::111111111111:role/PatchExecRole', 'region': region, 'targets': targets}
+                 for region in ('us-east-1', 'us-west-2', 'eu-west-1', 'eu-central-1', 'ap-southeast-1')]
+
+        results = self.send.handler({'batch': batch}, DummyContext())['Results']
+
+        self.assertEqual([r['CommandId'] for r in results], ['cmd-1'] * len(batch))
+        mock_sts.assume_role.assert_called_once()
+
+    def test_rejects_malformed_batch_before_sending(self):
+        mock_assume = self._patch('_assume')
+        for batch in (['not-a-dict'], [None], {'roleArn': 'x'}, 'batch'):
+            with self.assertRaises(ValueError):
+                self.send.handler({'batch': batch}, DummyContext())
+        mock_assume.assert_not_called()
+
+    def test_requires_targets(self):
+        mock_assume = self._patch('_assume')
+        event = {'roleArn': 'arn:aws:iam::123456789012:role/PatchExecRole', 'region': 'us-east-1'}
+        with self.assertRaises(ValueError):
+            self.send.handler(event, DummyContext())
+        mock_assume.assert_not_called()
+
+    def test_assumed_credentials_are_cached_until_near_expiry(self):
+        mock_sts = self._patch('_sts')
+        mock_sts.assume_role.return_value = {'Credentials': dict(
+            self.CREDS, Expiration=datetime.fromtimestamp(time.time() + 3600))}
+        role = 'arn:aws:iam::123456789012:role/PatchExecRole'
+
+        self.send._assume(role, 'ext')
+        self.send._assume(role, 'ext')
+        self.assertEqual(mock_sts.assume_role.call_count, 1)
+
+        self.send._assume(role, 'other-ext')
+        self.assertEqual(mock_sts.assume_role.call_count, 2)
+
+        mock_sts.assume_role.return_value = {'Credentials': dict(
+            self.CREDS, Expiration=datetime.fromtimestamp(time.time() + 60))}
+        self.send._CREDS_CACHE.clear()
+        self.send._assume(role, 'ext')
+        self.send._assume(role, 'ext')
+        self.assertEqual(mock_sts.assume_role.call_count, 4)
+
+
+class TestPollSsmCommand(unittest.TestCase):
+    """Unit tests for the SSM command poller"""
+
+    def setUp(self):
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        import PollSsmCommand
+        self.poll = PollSsmCommand
+
+    def test_retry_honors_retry_after_and_jitters_otherwise(self):
+        from botocore.exceptions import ClientError
+        hinted = ClientError({'Error': {'Code': 'ThrottlingException'},
+                              'ResponseMetadata': {'HTTPHeaders': {'retry-after': '7'}}}, 'ListCommandInvocations')
+        throttled = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'ListCommandInvocations')
+        calls = Mock(side_effect=[hinted, throttled, 'ok'], __name__='poll')
+        with patch.object(self.poll.time, 'sleep') as mock_sleep, \
+                patch.object(self.poll.random, 'uniform', return_value=0.25) as mock_uniform:
+            self.assertEqual(self.poll.retry_with_backoff(max_retries=3, base_delay=1.0)(calls)(), 'ok')
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [7.0, 0.25])
+        mock_uniform.assert_called_once_with(0, 2.0)
+
+    def test_handler_reports_elapsed_time_on_validation_error(self):
+        result = self.poll.handler({'roleArn': 'arn:aws:iam::123456789012:role/PatchExecRole'}, DummyContext())
+        self.assertEqual(result['statusCode'], 400)
+        self.assertEqual(result['error_type'], 'SSMPollingError')
+        self.assertGreaterEqual(result['execution_time_ms'], 0)
+        self.assertAlmostEqual(result['timestamp'], time.time(), delta=5)
+
+
 class TestStepFunctions(unittest.TestCase):
     """Integration tests for Step Functions workflow"""
     